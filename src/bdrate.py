@@ -0,0 +1,143 @@
+import html
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from loader import DataBank, metric_columns
+
+
+# Bjontegaard deltas: a cubic through every rate-distortion curve, integrated over the range two curves share.
+# Curves with fewer than this many rate points have no delta.
+MIN_POINTS = 4
+
+
+def fit_cubic(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # least squares cubics for a batch of curves, NaN or +-inf (lossless PSNR) marks a missing point; x is
+    # centered and scaled per curve first, so the fit stays well conditioned for bitrates in the thousands
+    valid = np.isfinite(x) & np.isfinite(y)
+    count = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        center = np.nanmean(np.where(valid, x, np.nan), axis=1)
+        scale = np.nanstd(np.where(valid, x, np.nan), axis=1)
+    scale = np.where(scale > 0, scale, 1.0)
+    center = np.nan_to_num(center)
+
+    t = np.where(valid, (x - center[:, None]) / scale[:, None], 0.0)
+    vandermonde = t[..., None] ** np.arange(4) * valid[..., None]
+    coefficients = np.linalg.pinv(vandermonde) @ np.where(valid, y, 0.0)[..., None]
+    coefficients = coefficients[..., 0]
+    coefficients[count < MIN_POINTS] = np.nan
+    return coefficients, center, scale
+
+
+def integral(coefficients: np.ndarray, center: np.ndarray, scale: np.ndarray, low: np.ndarray,
+             high: np.ndarray) -> np.ndarray:
+    # the integral of every fitted cubic over [low, high] in the original x
+    antiderivative = coefficients / np.arange(1, 5)
+
+    def at(x):
+        t = (x - center) / scale
+        return (antiderivative * t[:, None] ** np.arange(1, 5)).sum(axis=1)
+
+    return (at(high) - at(low)) * scale
+
+
+def average_delta(x: np.ndarray, y: np.ndarray, anchors: np.ndarray, tests: np.ndarray) -> np.ndarray:
+    # mean vertical distance between the y(x) cubics of the test and anchor curves over their common x range;
+    # the range only spans the points the cubics were fitted to
+    coefficients, center, scale = fit_cubic(x, y)
+    x = np.where(np.isfinite(x) & np.isfinite(y), x, np.nan)
+    with np.errstate(invalid='ignore'):
+        low = np.maximum(np.nanmin(x[anchors], axis=1), np.nanmin(x[tests], axis=1))
+        high = np.minimum(np.nanmax(x[anchors], axis=1), np.nanmax(x[tests], axis=1))
+        overlap = high - low
+        delta = (integral(coefficients[tests], center[tests], scale[tests], low, high)
+                 - integral(coefficients[anchors], center[anchors], scale[anchors], low, high)) / overlap
+    return np.where(overlap > 0, delta, np.nan)
+
+
+def curves(bank: DataBank, columns: List[str]) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    # one row per (tool, stream, column) curve: log10 of the bitrate and the quality, NaN padded to
+    # the largest number of rate points
+    df = bank.df[['tool', 'stream', 'real_bitrate'] + columns]
+    df = df[df['real_bitrate'] > 0]
+    keys = df[['tool', 'stream']].astype(str)
+    point = keys.groupby(['tool', 'stream'], sort=False).cumcount().to_numpy()
+    groups = keys.drop_duplicates().reset_index(drop=True)
+    group = pd.MultiIndex.from_frame(groups).get_indexer(pd.MultiIndex.from_frame(keys))
+    points = int(point.max()) + 1 if len(point) else 0
+
+    rate = np.full((len(groups), points), np.nan)
+    rate[group, point] = np.log10(df['real_bitrate'].to_numpy())
+    quality = np.full((len(groups), len(columns), points), np.nan)
+    quality[group, :, point] = df[columns].to_numpy(dtype=np.float64)
+
+    index = groups.loc[groups.index.repeat(len(columns))].reset_index(drop=True)
+    index['metric'] = columns * len(groups)
+    log_rate = np.repeat(rate, len(columns), axis=0)
+    return index, log_rate, quality.reshape(-1, points)
+
+
+def bd_rates(bank: DataBank, baseline: Optional[str] = None) -> pd.DataFrame:
+    """BD-rate and BD-quality of every tool against every other one, or against baseline only, for every
+    stream and metric column.
+
+    bd_rate is the average bitrate difference in percent at equal quality, negative when the tool needs
+    fewer bits than the anchor; bd_quality is the average quality difference at equal bitrate.
+    """
+    columns = [column for column in metric_columns(bank.extra_metrics) if column in bank.df]
+    index, log_rate, quality = curves(bank, columns)
+
+    tools = [tool.name for tool in bank.tools if tool.name in set(index['tool'])]
+    if baseline is not None and baseline not in tools:
+        raise ValueError(f'Baseline "{baseline}" is not one of the loaded tools: {", ".join(tools)}')
+    pairs = [(anchor, tool) for anchor in tools for tool in tools
+             if anchor != tool and (baseline is None or anchor == baseline)]
+
+    # anchor and test curve of every (pair, stream, metric), matched on (stream, metric)
+    curve = index.reset_index().rename(columns={'index': 'curve'})
+    pair_frame = pd.DataFrame(pairs, columns=['anchor', 'tool']).reset_index().rename(columns={'index': 'pair'})
+    rows = pair_frame.merge(curve.rename(columns={'tool': 'anchor', 'curve': 'anchors'}), on='anchor')
+    rows = rows.merge(curve.rename(columns={'curve': 'tests'}), on=['tool', 'stream', 'metric'])
+    rows = rows.sort_values(['pair', 'anchors'], ignore_index=True).drop(columns='pair')
+    anchors = rows.pop('anchors').to_numpy()
+    tests = rows.pop('tests').to_numpy()
+
+    with np.errstate(over='ignore'):
+        # a fit that runs away over the common range (curves that are not monotonic) overflows, which is no
+        # delta either: NaN, so the report shows '-' and the mean over streams skips it
+        bd_rate = (10 ** average_delta(quality, log_rate, anchors, tests) - 1) * 100
+    bd_quality = average_delta(log_rate, quality, anchors, tests)
+    rows['bd_rate'] = np.where(np.isfinite(bd_rate), bd_rate, np.nan)
+    rows['bd_quality'] = np.where(np.isfinite(bd_quality), bd_quality, np.nan)
+    return rows
+
+
+def summary_html(table: pd.DataFrame) -> str:
+    # BD-rate by stream and metric for every anchor and tool, with the mean over streams last
+    sections = []
+    for (anchor, tool), rows in table.groupby(['anchor', 'tool'], sort=False):
+        pivot = rows.pivot(index='stream', columns='metric', values='bd_rate')
+        pivot = pivot[[column for column in rows['metric'].unique()]]
+        pivot.loc['Mean'] = pivot.mean()
+        sections.append(f'<h2>{html.escape(tool)} vs {html.escape(anchor)}</h2>\n'
+                        + pivot.to_html(float_format=lambda value: f'{value:+.2f}%', na_rep='-'))
+
+    return (
+        '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>BD-rate</title>\n'
+        '<style>\n'
+        '  body { font: 11pt Calibri,"Helvetica Neue",Arial,sans-serif; }\n'
+        '  table { border-collapse: collapse; margin-bottom: 1em; }\n'
+        '  th, td { padding: 2px 8px; text-align: right; }\n'
+        '  tr:last-child { font-weight: bold; }\n'
+        '</style>\n</head>\n<body>\n'
+        '<p>Average bitrate difference at equal quality, negative when the tool needs fewer bits.</p>\n'
+        + '\n'.join(sections) + '\n</body>\n</html>\n'
+    )
+
+
+def write_report(table: pd.DataFrame, folder: Path):
+    table.to_csv(folder / 'bd-rate.csv', index=False, float_format='%.6g')
+    (folder / 'bd-rate.html').write_text(summary_html(table), encoding='utf8')
@@ -0,0 +1,349 @@
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from pathlib import Path
+from dataclasses import dataclass, asdict, replace
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from loader import Tool, METRICS
+
+
+@dataclass(frozen=True)
+class Scale:
+    tools: int
+    streams: int
+    rate_points: int
+    frames: int
+    metrics: str = 'vmaf,psnr,ssim,mssim'
+
+
+# modules generate.py must not import before a stage needs them
+HEAVY_MODULES = ['pandas', 'altair', 'jinja2', 'num2words']
+
+STARTUP = '''
+import io, sys, json, time, runpy, contextlib
+start = time.perf_counter()
+sys.argv = ['generate.py', '--help']
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        runpy.run_path('generate.py', run_name='__main__')
+    except SystemExit:
+        pass
+help_seconds = time.perf_counter() - start
+help_modules = [module for module in HEAVY if module in sys.modules]
+start = time.perf_counter()
+import charts
+print(json.dumps({
+    'help_seconds': help_seconds,
+    'help_modules': help_modules,
+    'charts_seconds': time.perf_counter() - start,
+    'charts_modules': [module for module in HEAVY if module in sys.modules],
+}))
+'''
+
+# a second run over unchanged artifacts: every page and the index are reused, nothing is rendered
+REBUILD = '''
+import io, sys, json, time, runpy, contextlib
+start = time.perf_counter()
+sys.argv = ['generate.py'] + ARGS
+output = io.StringIO()
+with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+    try:
+        runpy.run_path('generate.py', run_name='__main__')
+    except SystemExit:
+        pass
+print(json.dumps({
+    'rebuild_seconds': time.perf_counter() - start,
+    'rebuild_modules': [module for module in HEAVY if module in sys.modules],
+    'rebuild_output': output.getvalue().strip().splitlines(),
+}))
+'''
+
+REBUILD_SCALE = Scale(tools=2, streams=2, rate_points=2, frames=10)
+
+SCALES = {
+    'small': Scale(tools=2, streams=2, rate_points=4, frames=300),
+    'medium': Scale(tools=3, streams=4, rate_points=4, frames=3000),
+    'large': Scale(tools=3, streams=4, rate_points=5, frames=10000),
+}
+
+
+def metric_names(scale: Scale) -> List[str]:
+    names = [metric.strip().upper() for metric in scale.metrics.split(',') if metric.strip()]
+    for name in names:
+        if name != 'VMAF' and name not in METRICS:
+            sys.exit(f'Unknown metric "{name}", use VMAF, PSNR, SSIM or MSSIM')
+    return names
+
+
+def components(rng: random.Random, metric: str, indent: str) -> str:
+    low, high = (30.0, 48.0) if metric == 'PSNR' else (0.8, 1.0)
+    return ''.join(f'{indent}{component}: {rng.uniform(low, high)!r}\n' for component in 'UVY')
+
+
+def summary_yaml(rng: random.Random, br: int, metrics: List[str]) -> str:
+    # the shape of <br>.<stream>.yaml as edc writes it
+    text = 'metrics:\n'
+    for metric in sorted(metrics):
+        if metric == 'VMAF':
+            text += f'  VMAF: {rng.uniform(60, 99)!r}\n'
+        else:
+            text += f'  {metric}:\n' + components(rng, metric, '    ')
+    return text + f'real_bitrate: {br * 1.01 + rng.random()!r}\n'
+
+
+def details_yaml(rng: random.Random, frames: int, metrics: List[str]) -> str:
+    # the shape of <br>.<stream>.details.yaml: a list with one mapping per frame
+    lines = []
+    for _ in range(frames):
+        frame = ''
+        for metric in sorted(metrics):
+            if metric == 'VMAF':
+                frame += f'  VMAF: {rng.uniform(50, 100)!r}\n'
+            else:
+                frame += f'  {metric}:\n' + components(rng, metric, '    ')
+        frame += f'  frame_size: {rng.randint(1000, 90000)}\n'
+        lines.append('-' + frame[1:])
+    return ''.join(lines)
+
+
+def generate_tree(root: Path, scale: Scale, seed: int = 1) -> Dict[str, Any]:
+    # writes <root>/.cache/<tool>.<md5>/ for every tool, stream and rate point and returns the matching config
+    metrics = metric_names(scale)
+    rng = random.Random(seed)
+    bitrates = [500 * 2 ** i for i in range(scale.rate_points)]
+    tools = [{'label': f'tool{i}', 'command-line': f'encoder --preset {i}'} for i in range(scale.tools)]
+    streams = [{'stream': f'stream{i}.yuv'} for i in range(scale.streams)]
+
+    for tool in tools:
+        folder = Tool(tool, root, qp=False).folder
+        folder.mkdir(parents=True, exist_ok=True)
+        for stream in streams:
+            for br in bitrates:
+                name = f'{br}.{stream["stream"]}'
+                (folder / f'{name}.yaml').write_text(summary_yaml(rng, br, metrics), encoding='utf8')
+                (folder / f'{name}.details.yaml').write_text(details_yaml(rng, scale.frames, metrics), encoding='utf8')
+
+    return {
+        'bitrates': bitrates,
+        'extra-metrics': [metric.lower() for metric in metrics],
+        'per-frame-metrics': [metric.lower() for metric in metrics],
+        'tools': tools,
+        'streams': streams,
+    }
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_scale(name: str, scale: Scale, folder: Path, jobs: int) -> Dict[str, Any]:
+    # runs in a fresh process, so peak RSS belongs to this scale alone
+    from loader import load_data
+    from charts import generate_charts, PageOptions
+    from profiling import profiler
+
+    data = folder / name
+    marker = data / 'scale.json'
+    if marker.exists() and json.loads(marker.read_text()) == asdict(scale):
+        cfg = json.loads((data / 'edc.json').read_text())
+    else:
+        shutil.rmtree(data, ignore_errors=True)
+        data.mkdir(parents=True)
+        cfg = generate_tree(data, scale)
+        (data / 'edc.json').write_text(json.dumps(cfg))
+        marker.write_text(json.dumps(asdict(scale)))
+
+    charts = data / 'charts'
+    shutil.rmtree(charts, ignore_errors=True)
+    charts.mkdir()
+
+    profiler.enabled = True
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        start = time.perf_counter()
+        bank = load_data(cfg, data, jobs=jobs, use_cache=False)
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        generate_charts(bank, charts, force=True, jobs=jobs, options=PageOptions())
+        charts_seconds = time.perf_counter() - start
+
+    files = len(bank.artifacts)
+    frames = bank.frame_count()
+    html_mb = sum(fn.stat().st_size for fn in charts.rglob('*') if fn.is_file()) / 2 ** 20
+    return {
+        'scale': name,
+        'parameters': asdict(scale),
+        'jobs': jobs,
+        'load_seconds': round(load_seconds, 3),
+        'charts_seconds': round(charts_seconds, 3),
+        'files_per_second': round(files / load_seconds, 1),
+        'frames_per_second': round(frames / load_seconds, 1),
+        'html_mb': round(html_mb, 2),
+        'html_mb_per_second': round(html_mb / charts_seconds, 2),
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': {stage: round(record.seconds, 3) for stage, record in profiler.totals().items()},
+    }
+
+
+def run_code(code: str) -> Dict[str, Any]:
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def measure_startup(runs: int = 3) -> Dict[str, Any]:
+    # fresh interpreters, the median run is kept
+    with tempfile.TemporaryDirectory() as folder:
+        data = Path(folder)
+        (data / 'edc.yaml').write_text(json.dumps(generate_tree(data, REBUILD_SCALE)))
+        arguments = [str(data / 'edc.yaml'), '--artifacts', str(data), '--charts', str(data / 'charts')]
+        subprocess.run([sys.executable, 'generate.py'] + arguments, cwd=Path(__file__).parent,
+                       capture_output=True, check=True)
+
+        samples = []
+        for _ in range(runs):
+            sample = run_code(f'HEAVY = {HEAVY_MODULES!r}\n' + STARTUP)
+            sample.update(run_code(f'HEAVY = {HEAVY_MODULES!r}\nARGS = {arguments!r}\n' + REBUILD))
+            samples.append(sample)
+    samples.sort(key=lambda sample: sample['help_seconds'])
+    startup = samples[len(samples) // 2]
+    return {key: round(value, 3) if isinstance(value, float) else value for key, value in startup.items()}
+
+
+def check_startup(startup: Dict[str, Any], budget: float) -> List[str]:
+    problems = []
+    if startup['help_seconds'] > budget:
+        problems.append(f'generate.py --help took {startup["help_seconds"]}s, the budget is {budget}s')
+    if startup['help_modules']:
+        problems.append(f'generate.py --help imported {", ".join(startup["help_modules"])}')
+    eager = [module for module in startup['charts_modules'] if module in ('altair', 'jinja2')]
+    if eager:
+        problems.append(f'importing charts imported {", ".join(eager)}')
+    # the pages have to come from the generated artifacts, a run that found none reuses nothing worth checking
+    output = startup['rebuild_output']
+    artifacts = REBUILD_SCALE.tools * REBUILD_SCALE.streams * REBUILD_SCALE.rate_points * 2
+    if any('not found' in line for line in output) \
+            or f'{artifacts} of {artifacts} artifacts read from the parsed cache' not in output:
+        problems.append(f'a run over unchanged artifacts did not load all {artifacts} of them: {output}')
+    if not output or not output[-1].endswith(' 0 rebuilt'):
+        problems.append(f'a run over unchanged artifacts did not reuse every page: {output[-1:]}')
+    rendered = [module for module in startup['rebuild_modules'] if module in ('altair', 'jinja2')]
+    if rendered:
+        problems.append(f'a run over unchanged artifacts imported {", ".join(rendered)}')
+    return problems
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_results(results: List[Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]):
+    columns = ['load_seconds', 'charts_seconds', 'files_per_second', 'frames_per_second', 'html_mb_per_second',
+               'peak_rss_mb']
+    table = [['scale'] + columns]
+    for result in results:
+        row = [result['scale']]
+        for column in columns:
+            cell = f'{result[column]}'
+            previous = baseline.get(result['scale'], {}).get(column)
+            if previous and result[column] is not None:
+                cell += f' ({result[column] / previous:.2f}x)'
+            row.append(cell)
+        table.append(row)
+
+    widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+    for row in table:
+        cells = [row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+        print('  '.join(cells))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Loader and chart generation benchmark on synthetic edc artifacts')
+    parser.add_argument('scales', nargs='*', default=['small', 'medium'], help='Scales to run: '
+                                                            + ', '.join(SCALES) + ' or custom. (default: small medium)')
+    parser.add_argument('--tools', type=int, help='Number of tools of the custom scale.')
+    parser.add_argument('--streams', type=int, help='Number of streams of the custom scale.')
+    parser.add_argument('--rate-points', type=int, help='Number of bitrates per stream of the custom scale.')
+    parser.add_argument('--frames', type=int, help='Number of frames per stream of the custom scale.')
+    parser.add_argument('--metrics', help='Comma separated metrics present in the artifacts of the custom scale.'
+                                                            ' (default: vmaf,psnr,ssim,mssim)')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Worker processes used by the loader and'
+                                                            ' the chart generator. (default: %(default)s)')
+    parser.add_argument('--data', help='Directory keeping the generated artifacts between runs.'
+                                                            ' (default: a temporary directory)')
+    parser.add_argument('--output', default='bench.json', help='Where results are written. (default: %(default)s)')
+    parser.add_argument('--baseline', help='Results of a previous run to compare with.')
+    parser.add_argument('--startup-budget', type=float, default=0.5, help='Seconds generate.py --help may take'
+                                                            ' before the benchmark fails. (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    scales = {}
+    for name in args.scales:
+        if name == 'custom':
+            overrides = {
+                key: value for key, value in [
+                    ('tools', args.tools), ('streams', args.streams), ('rate_points', args.rate_points),
+                    ('frames', args.frames), ('metrics', args.metrics)
+                ] if value is not None
+            }
+            scales[name] = replace(SCALES['small'], **overrides)
+        elif name in SCALES:
+            scales[name] = SCALES[name]
+        else:
+            sys.exit(f'Unknown scale "{name}", use {", ".join(SCALES)} or custom')
+
+    baseline = {}
+    if args.baseline:
+        baseline = {result['scale']: result for result in json.loads(Path(args.baseline).read_text())['results']}
+
+    startup = measure_startup()
+    problems = check_startup(startup, args.startup_budget)
+    print(f'startup: {startup["help_seconds"]}s --help, {startup["charts_seconds"]}s to import charts,'
+          f' {startup["rebuild_seconds"]}s for a run with nothing to rebuild')
+
+    with contextlib.ExitStack() as stack:
+        folder = Path(args.data) if args.data else Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        results = []
+        for name, scale in scales.items():
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                results.append(executor.submit(run_scale, name, scale, folder, max(1, args.jobs)).result())
+            print(f'{name}: {results[-1]["load_seconds"]}s load, {results[-1]["charts_seconds"]}s charts')
+
+    print_results(results, baseline)
+    Path(args.output).write_text(json.dumps({
+        'commit': current_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'startup': startup,
+        'results': results,
+    }, indent=2))
+
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    if problems:
+        sys.exit(1)
@@ -1,12 +1,21 @@
 import sys
+import gzip
 import json
-from dataclasses import dataclass
+import shutil
+import hashlib
+from urllib.parse import quote
+from dataclasses import dataclass, asdict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from typing import Dict, Tuple, List, Any
+from functools import partial
+from typing import Dict, Tuple, List, Any, Callable, Optional
 
-import jinja2
-import altair as alt
-from loader import DataBank, Stream
+import numpy as np
+import pandas as pd
+from loader import DataBank, Stream, METRICS, COMPONENTS
+from downsample import downsample
+from profiling import profiler, profiled
+from specs import Shape, altair, altair_spec, inline_spec, named_spec, rows_json, same_spec
 
 
 if getattr(sys, 'frozen', False):
@@ -15,12 +24,26 @@ else:
     current_folder = Path(__file__).parent
 
 
+# bump when chart generation changes in a way that should invalidate pages built earlier
+CHARTS_VERSION = 2
+
+
 @dataclass
 class Chart:
     metric: str
     data: str
 
 
+@dataclass
+class PageOptions:
+    # emit per-frame rows once per rate point as a named dataset shared by all frame charts
+    shared_data: bool = False
+    # write every chart (and shared dataset) to its own gzipped JSON file, fetched by the page on demand
+    lazy: bool = False
+    # build every spec through Altair as well and fail if the spec factory output differs
+    check_specs: bool = False
+
+
 template = '''
 <!DOCTYPE html>
 <html>
@@ -46,12 +69,25 @@ const mean_charts = {};
 const worst_charts = {};
 const frame_charts = {};
 const frame_size_charts = {};
-
+const datasets = {};
+const charts = {mean: mean_charts, worst: worst_charts, frame: frame_charts, frame_size: frame_size_charts, datasets: datasets};
+const chartKeys = {{ chart_keys }};
+const payloadUrl = {{ payload_url }};
+const pendingEmbeds = {};
+// compiled views by kind, target and spec layout; a chart with the layout of a view already built
+// only swaps that view's rows
+const views = {mean: {}, worst: {}, frame: {}, frame_size: {}};
+
+const worstAggregates = {{ worst_aggregates }};
 const qps = {{ qps }};
 const bitrates = {{ bitrates }};
 let selectedOption = null;
 
 function fillChartsData() {
+{% for name, rows in datasets.items() -%}
+datasets["{{name}}"] = {{rows}};
+{% endfor %}
+
 {% for chart in mean_charts -%}
 mean_charts.{{chart.metric}} = {{chart.data}};
 {% endfor %}
@@ -69,10 +105,72 @@ frame_size_charts.{{chart.metric}} = {{chart.data}};
 {% endfor %}
 }
 
+function hasCharts(kind) {
+    return chartKeys[kind].length > 0;
+}
+
+async function loadPayload(kind, key) {
+    const response = await fetch(payloadUrl.replace('{kind}', kind).replace('{key}', key));
+    if (!response.ok) {
+        throw new Error(`${response.status} ${response.statusText}: ${response.url}`);
+    }
+    if (response.url.endsWith('.gz')) {
+        return new Response(response.body.pipeThrough(new DecompressionStream('gzip'))).json();
+    }
+    return response.json();
+}
+
+function getPayload(kind, key) {
+    const cache = charts[kind];
+    if (!(key in cache) && payloadUrl) {
+        cache[key] = loadPayload(kind, key);
+    }
+    return cache[key];
+}
+
+function specLayout(spec) {
+    // everything a compiled view depends on except its rows
+    const {data, datasets, ...layout} = spec;
+    return JSON.stringify(layout);
+}
+
+async function embed(target, kind, key) {
+    if (!chartKeys[kind].includes(key)) return;
+    // a later embed into the same target wins, even if its payload arrives first
+    const token = pendingEmbeds[target] = {};
+    const spec = await getPayload(kind, key);
+    const name = spec.data.name;
+    const values = chartKeys.datasets.includes(name) ? await getPayload('datasets', name) : spec.datasets[name];
+    if (pendingEmbeds[target] !== token) return;
+
+    const targetViews = views[kind][target] = views[kind][target] || {};
+    const layout = specLayout(spec);
+    let entry = targetViews[layout];
+    if (!entry) {
+        const el = $('<div></div>').appendTo(target)[0];
+        const compiled = vegaEmbed(el, {...spec, datasets: {[name]: values}}, embed_opt).then(result => result.view);
+        entry = targetViews[layout] = {el: el, name: name, values: values, view: compiled};
+    }
+    const view = await entry.view;
+    if (pendingEmbeds[target] !== token) return;
+
+    if (entry.values !== values) {
+        entry.values = values;
+        await view.data(entry.name, values).runAsync();
+    }
+    for (const other of Object.values(targetViews)) {
+        other.el.style.display = other === entry ? '' : 'none';
+    }
+    return view;
+}
+
 function createDivs() {
     for(const metric of availableMetrics) {
         $(`<div id="mean_${metric}"></div>`).appendTo('div.mean');
         $(`<div id="worst_${metric}"></div>`).appendTo('div.worst');
+        for (const aggregate of worstAggregates) {
+            $(`<div id="worst_${metric}_${aggregate}"></div>`).appendTo('div.worst');
+        }
         $(`<div id="frame_${metric}"></div>`).appendTo('div.frame');
     }
 }
@@ -86,9 +184,12 @@ function attachComponentListeners() {
         const component = $el.data('component');
 
         for(const metric of availableMetrics) {
-            vegaEmbed(`#mean_${metric}`, mean_charts[`${metric}_${component}`], embed_opt);
-            vegaEmbed(`#worst_${metric}`, worst_charts[`${metric}_${component}`], embed_opt);
-            vegaEmbed(`#frame_${metric}`, frame_charts[`${metric}_${component}_${selectedOption}`], embed_opt);
+            embed(`#mean_${metric}`, 'mean', `${metric}_${component}`);
+            embed(`#worst_${metric}`, 'worst', `${metric}_${component}`);
+            for (const aggregate of worstAggregates) {
+                embed(`#worst_${metric}_${aggregate}`, 'worst', `${metric}_${component}_${aggregate}`);
+            }
+            embed(`#frame_${metric}`, 'frame', `${metric}_${component}_${selectedOption}`);
         }
     });
 }
@@ -97,12 +198,12 @@ function changeHandler() {
     const selectedValue = $( "#br_and_qps option:selected" ).val();
     for(const metric of availableMetrics) {
         if (hadVMAF) {
-            vegaEmbed('#frame_VMAF', frame_charts[`VMAF_${selectedValue}`], embed_opt);
+            embed('#frame_VMAF', 'frame', `VMAF_${selectedValue}`);
         }
         const component = $('.component.active-component').data('component')
-        vegaEmbed(`#frame_${metric}`, frame_charts[`${metric}_${component}_${selectedValue}`], embed_opt);
-        if (!jQuery.isEmptyObject(frame_size_charts)) {
-            vegaEmbed('#frame_size', frame_size_charts[`frame_size_${selectedValue}`], embed_opt);
+        embed(`#frame_${metric}`, 'frame', `${metric}_${component}_${selectedValue}`);
+        if (hasCharts('frame_size')) {
+            embed('#frame_size', 'frame_size', `frame_size_${selectedValue}`);
         }
 
     }
@@ -113,25 +214,31 @@ $(function() {
     attachComponentListeners();
     fillChartsData();
     selectedOption = qps.length ? qps[0] : bitrates[0];
-    if (!jQuery.isEmptyObject(frame_size_charts)) {
-        vegaEmbed('#frame_size', frame_size_charts[`frame_size_${selectedOption}`], embed_opt);
+    if (hasCharts('frame_size')) {
+        embed('#frame_size', 'frame_size', `frame_size_${selectedOption}`);
     }
     for (const metric of availableMetrics) {
         if (metric === 'VMAF') {
-            vegaEmbed('#mean_VMAF', mean_charts.VMAF, embed_opt);
-            if (!jQuery.isEmptyObject(frame_charts)) {
-                vegaEmbed('#worst_VMAF', worst_charts.VMAF, embed_opt);
-                vegaEmbed('#frame_VMAF', frame_charts[`VMAF_${selectedOption}`], embed_opt);
+            embed('#mean_VMAF', 'mean', 'VMAF');
+            if (hasCharts('frame')) {
+                embed('#worst_VMAF', 'worst', 'VMAF');
+                for (const aggregate of worstAggregates) {
+                    embed(`#worst_VMAF_${aggregate}`, 'worst', `VMAF_${aggregate}`);
+                }
+                embed('#frame_VMAF', 'frame', `VMAF_${selectedOption}`);
             }
         } else {
-            vegaEmbed(`#mean_${metric}`, mean_charts[`${metric}_Y`], embed_opt);
-            if (!jQuery.isEmptyObject(frame_charts)) {
-                vegaEmbed(`#worst_${metric}`, worst_charts[`${metric}_Y`], embed_opt);
-                vegaEmbed(`#frame_${metric}`, frame_charts[`${metric}_Y_${selectedOption}`], embed_opt);
+            embed(`#mean_${metric}`, 'mean', `${metric}_Y`);
+            if (hasCharts('frame')) {
+                embed(`#worst_${metric}`, 'worst', `${metric}_Y`);
+                for (const aggregate of worstAggregates) {
+                    embed(`#worst_${metric}_${aggregate}`, 'worst', `${metric}_Y_${aggregate}`);
+                }
+                embed(`#frame_${metric}`, 'frame', `${metric}_Y_${selectedOption}`);
             }
         }
     }
-    if (!jQuery.isEmptyObject(frame_charts)) {
+    if (hasCharts('frame')) {
         $("<label for='br_and_qps'>Bitrates and QPs</label>").appendTo("div#controls");
 
         const select = $("<select name='br_and_qps' id='br_and_qps'></select>")
@@ -176,329 +283,587 @@ $(function() {
 '''
 
 
-def compact_json(source: str) -> str:
-    jsn = json.loads(source)
-    return json.dumps(jsn, separators=(',', ':'))
+index_template = '''
+<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>edc summary</title>
+  <script src="https://cdn.jsdelivr.net/npm/vega@5"></script>
+  <script src="https://cdn.jsdelivr.net/npm/vega-lite@4"></script>
+  <script src="https://cdn.jsdelivr.net/npm/vega-embed@6"></script>
+  <script src="https://code.jquery.com/jquery-3.6.0.slim.min.js" integrity="sha256-u7e5khyithlIdTpu22PHhENmPcRdFiHRjhAuHcs05RI=" crossorigin="anonymous"></script>
+  <style>
+    body { font: 11pt Calibri,"Helvetica Neue",Arial,sans-serif; }
+    label { margin-right: 2px; }
+    table { border-collapse: collapse; margin-top: 1em; }
+    th, td { padding: 2px 8px; text-align: right; }
+    th:first-child, td:first-child { text-align: left; }
+    .best { font-weight: bold; }
+  </style>
+<script>
+const embed_opt = {"mode": "vega-lite"};
+// per-tool means over every stream at each rate point, the one dataset all average charts share
+const average = {{ average }};
+const specs = {{ specs }};
+// summary.means[stream][tool][metric]: the mean over the stream's rate points, null when missing
+const summary = {{ summary }};
+
+function showAverage(metric) {
+    vegaEmbed('#average', {...specs[metric], datasets: {average: average}}, embed_opt);
+}
 
+function showRanking(metric) {
+    const m = summary.metrics.indexOf(metric);
+    const header = $('<tr></tr>').append($('<th></th>').text('Stream'));
+    for (const tool of summary.tools) {
+        header.append($('<th></th>').text(tool));
+    }
+    header.append($('<th></th>').text('Ranking'));
+
+    const rows = [header];
+    summary.streams.forEach((stream, s) => {
+        const values = summary.tools.map((_, t) => summary.means[s][t][m]);
+        const ranked = summary.tools.map((tool, t) => [tool, values[t]]).filter(([_, value]) => value !== null);
+        ranked.sort((a, b) => b[1] - a[1]);
+        const best = ranked.length ? ranked[0][1] : null;
+
+        const row = $('<tr></tr>').append($('<td></td>').append($('<a></a>').attr('href', stream.page).text(stream.name)));
+        for (const value of values) {
+            const cell = $('<td></td>').text(value === null ? '-' : value.toFixed(summary.precision[m]));
+            row.append(value !== null && value === best ? cell.addClass('best') : cell);
+        }
+        row.append($('<td></td>').text(ranked.map(([tool]) => tool).join(' > ')));
+        rows.push(row);
+    });
+    $('#ranking').empty().append(rows);
+}
 
-def generate_mean_charts(bank: DataBank, stream: Stream) -> Dict[str,Any]:
-    charts = []
+$(function() {
+    const select = $('#metric');
+    for (const metric of summary.metrics) {
+        $('<option></option>').val(metric).text(metric.replace('_', ' ')).appendTo(select);
+    }
+    select.change(function() {
+        showAverage(this.value);
+        showRanking(this.value);
+    });
+    if (summary.metrics.length) {
+        showAverage(summary.metrics[0]);
+        showRanking(summary.metrics[0]);
+    }
+})
+</script>
+</head>
+<body>
+<label for="metric">Metric</label><select id="metric"></select>
+<div id="average"></div>
+<table id="ranking"></table>
+</body>
+</html>
+'''
+
+
+def tooltip_format(metric: str) -> str:
+    return '.2f' if metric == 'PSNR' else '.4f'
 
-    df = bank.df.query(f"stream == '{stream.name}'")
-    for metric in ['PSNR', 'SSIM', 'MSSIM']:
-        if metric in bank.extra_metrics:
-           for component in ['Y', 'U', 'V', 'YUV']:
-                columns = set(['stream', 'VMAF',
-                    'PSNR_Y', 'PSNR_U', 'PSNR_V', 'PSNR_YUV',
-                    'SSIM_Y', 'SSIM_U', 'SSIM_V', 'SSIM_YUV',
-                    'MSSIM_Y', 'MSSIM_U', 'MSSIM_V', 'MSSIM_YUV'
-                ])
-                columns.discard(f'{metric}_{component}')
-                md = df.rename(columns={'br_or_qp': 'q', 'real_bitrate': 'b'})
-                metric_df = md.drop(columns=columns)
-                tooltip_format = '.2f' if metric == 'PSNR' else '.4f'
-                selection = alt.selection_multi(fields=['tool'], bind='legend')
-                chart = Chart(f'{metric}_{component}', alt.Chart(metric_df).mark_line(point=True, interpolate='monotone').encode(
-                    alt.X('b', scale=alt.Scale(zero=False), title='Bitrate (Kb/s)'),
-                    alt.Y(f'{metric}_{component}', scale=alt.Scale(zero=False), title=f'Mean {metric} {component}'),
-                    color='tool',
-                    tooltip=[
-                        alt.Tooltip('b:Q', format=',.1f', title='Bitrate'),
-                        alt.Tooltip(f'{metric}_{component}:Q', format=tooltip_format, title=f'{metric} {component}')
-                    ],
-                    opacity=alt.condition(selection, alt.value(1), alt.value(0.1))
-                ).configure_legend(
-                    orient='top'
-                ).interactive().add_selection(
-                    selection
-                ).to_json())
-
-                chart.data = compact_json(chart.data)
-                charts.append(chart)
 
+def charted_metrics(bank: DataBank) -> List[Tuple[str, Optional[str]]]:
+    # (metric, component) pairs in page order, VMAF has no components; only the columns the bank loaded
+    metrics = [(metric, component) for metric in METRICS if metric in bank.extra_metrics for component in COMPONENTS]
     if 'VMAF' in bank.extra_metrics:
-        md = df.rename(columns={'br_or_qp': 'q', 'real_bitrate': 'b'})
-        vmaf_df = md.drop(columns=[
-            'stream',
-            'PSNR_Y', 'PSNR_U', 'PSNR_V', 'PSNR_YUV',
-            'SSIM_Y', 'SSIM_U', 'SSIM_V', 'SSIM_YUV',
-            'MSSIM_Y', 'MSSIM_U', 'MSSIM_V', 'MSSIM_YUV'
-        ])
-        selection = alt.selection_multi(fields=['tool'], bind='legend')
-        chart = Chart('VMAF', alt.Chart(vmaf_df).mark_line(point=True, interpolate='monotone').encode(
-            alt.X('b', scale=alt.Scale(zero=False), title='Bitrate (Kb/s)'),
-            alt.Y('VMAF', scale=alt.Scale(zero=False), title='Mean VMAF'),
-            color='tool',
-            tooltip=[
-                alt.Tooltip('b:Q', format=',.1f', title='Bitrate'),
-                alt.Tooltip('VMAF:Q', format='.1f')
-            ],
-            opacity=alt.condition(selection, alt.value(1), alt.value(0.1))
-        ).configure_legend(
-            orient='top'
-        ).interactive().add_selection(
-            selection
-        ).to_json())
-
-        chart.data = compact_json(chart.data)
-        charts.append(chart)
+        metrics.append(('VMAF', None))
+    return [(metric, component) for metric, component in metrics if column_name(metric, component) in bank.df]
+
+
+def column_name(metric: str, component: Optional[str]) -> str:
+    return f'{metric}_{component}' if component else metric
+
+
+def rd_shape(aggregate: str, metric: str, component: Optional[str]) -> Shape:
+    if component:
+        field = column_name(metric, component)
+        tooltip = (field, tooltip_format(metric), f'{metric} {component}')
+        title = f'{aggregate} {metric} {component}'
+    else:
+        field = metric
+        tooltip = (field, '.1f', None)
+        title = f'{aggregate} {metric}'
+
+    return Shape(
+        x='b', x_title='Bitrate (Kb/s)', x_zero=False,
+        y=field, y_title=title,
+        tooltips=(('b', ',.1f', 'Bitrate'), tooltip),
+        legend_top=True
+    )
+
+
+def frame_shape(metric: str, component: Optional[str]) -> Shape:
+    if component:
+        field = column_name(metric, component)
+        title = f'{metric} {component}'
+        tooltip = (field, tooltip_format(metric), title)
+    else:
+        field = metric
+        title = None
+        tooltip = (field, '.1f', None)
+
+    return Shape(
+        x='f',
+        y=field, y_title=title,
+        tooltips=(('f', None, 'Frame'), tooltip, ('q', None, 'Bitrate or QP')),
+        width=1450
+    )
+
+
+FRAME_SIZE_SHAPE = Shape(
+    x='f',
+    y='s', y_title='Frame Size',
+    tooltips=(('f', None, 'Frame'), ('s', None, 'Frame Size'), ('q', None, 'Bitrate or QP')),
+    width=1450
+)
+
+
+def chart_spec(md: pd.DataFrame, shape: Shape, options: PageOptions) -> str:
+    spec = inline_spec(md, shape)
+    if options.check_specs and not same_spec(spec, altair_spec(md, shape)):
+        raise ValueError(f'Spec factory output differs from Altair for {shape}')
+    return spec
+
+
+def frame_columns(bank: DataBank, df: pd.DataFrame) -> List[str]:
+    # the per-frame columns charted from df, which is also what a shared frame dataset carries
+    columns = [column_name(metric, component) for metric, component in charted_metrics(bank)]
+    columns = [column for column in columns if column in df]
+    if bank.has_file_sizes:
+        columns.append('frame_size')
+    return columns
+
+
+def sampled_frames(bank: DataBank, stream: Stream, df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    # rows kept by downsampling each tool's series of each column; the union over the columns,
+    # so one table still serves every chart drawn from it
+    settings = bank.downsample
+    if settings is None or not stream.downsample or len(df) <= settings.points:
+        return df
+
+    frames = df['frame'].to_numpy()
+    rows = []
+    for positions in df.groupby('tool', observed=True).indices.values():
+        for column in columns:
+            kept = downsample(frames[positions], df[column].to_numpy()[positions], settings.method, settings.points)
+            rows.append(positions[kept])
+    return df.iloc[np.unique(np.concatenate(rows))] if rows else df
+
+
+def frame_spec(bank: DataBank, md: pd.DataFrame, df: pd.DataFrame, qp, shape: Shape, options: PageOptions,
+               datasets: Optional[Dict[str, str]]) -> str:
+    if datasets is None:
+        return chart_spec(md, shape, options)
+
+    name = f'frame_{qp}'
+    if name not in datasets:
+        columns = ['br_or_qp', 'frame', 'tool'] + frame_columns(bank, df)
+        datasets[name] = rows_json(df[columns].rename(columns={'br_or_qp': 'q', 'frame': 'f', 'frame_size': 's'}))
+
+    spec = named_spec(shape, name)
+    if options.check_specs and not same_spec(spec, altair_spec(altair().NamedData(name=name), shape)):
+        raise ValueError(f'Spec factory output differs from Altair for {shape}')
+    return spec
+
+
+def mean_chart(bank: DataBank, stream: Stream, metric: str, component: Optional[str], options: PageOptions) -> str:
+    field = column_name(metric, component)
+    md = bank.stream_df(stream)[['tool', 'br_or_qp', 'real_bitrate', field]]
+    md = md.rename(columns={'br_or_qp': 'q', 'real_bitrate': 'b'})
+    return chart_spec(md, rd_shape('Mean', metric, component), options)
+
+
+def generate_mean_charts(bank: DataBank, stream: Stream, options: PageOptions) -> List[Chart]:
+    charts = []
+    for metric, component in charted_metrics(bank):
+        charts.append(Chart(column_name(metric, component), mean_chart(bank, stream, metric, component, options)))
 
     return charts
 
 
-def generate_worst_charts(bank: DataBank, stream: Stream) -> Dict[str,Any]:
-    charts = []
+def aggregate_title(aggregate: str) -> str:
+    return {'min': 'Worst', 'std': 'Std dev', 'hmean': 'Harmonic mean'}.get(aggregate, aggregate.upper())
 
-    stream_df = bank.df.query(f'stream == "{stream.name}"')
-    stream_df = stream_df.drop(columns=[
-        'stream', 'VMAF',
-        'PSNR_Y', 'PSNR_U', 'PSNR_V', 'PSNR_YUV',
-        'SSIM_Y', 'SSIM_U', 'SSIM_V', 'SSIM_YUV',
-        'MSSIM_Y', 'MSSIM_U', 'MSSIM_V', 'MSSIM_YUV'
-    ]).set_index(['tool', 'br_or_qp'])
-
-    df = bank.details_df.query(f'stream == "{stream.name}"')
-    for metric in ['PSNR', 'SSIM', 'MSSIM']:
-        if metric in bank.extra_metrics:
-           for component in ['Y', 'U', 'V', 'YUV']:
-                columns = set(['stream', 'VMAF', 'frame_size',
-                    'PSNR_Y', 'PSNR_U', 'PSNR_V', 'PSNR_YUV',
-                    'SSIM_Y', 'SSIM_U', 'SSIM_V', 'SSIM_YUV',
-                    'MSSIM_Y', 'MSSIM_U', 'MSSIM_V', 'MSSIM_YUV',
-                    'frame'
-                ])
-                columns.discard(f'{metric}_{component}')
-                metric_details_df = df.drop(columns=columns)
-
-                worst_metric = metric_details_df.groupby(['tool', 'br_or_qp']).min().reset_index()
-                worst_metric = stream_df.join(worst_metric.set_index(['tool', 'br_or_qp'])).reset_index()
-
-                wm = worst_metric.rename(columns={'br_or_qp': 'q', 'real_bitrate': 'b'})
-
-                tooltip_format = '.2f' if metric == 'PSNR' else '.4f'
-                selection = alt.selection_multi(fields=['tool'], bind='legend')
-                chart = Chart(f'{metric}_{component}', alt.Chart(wm).mark_line(point=True, interpolate='monotone').encode(
-                    alt.X('b', scale=alt.Scale(zero=False), title='Bitrate (Kb/s)'),
-                    alt.Y(f'{metric}_{component}', scale=alt.Scale(zero=False), title=f'Worst {metric} {component}'),
-                    color='tool',
-                    tooltip=[
-                        alt.Tooltip('b:Q', format=',.1f', title='Bitrate'),
-                        alt.Tooltip(f'{metric}_{component}:Q', format=tooltip_format, title=f'{metric} {component}')
-                    ],
-                    opacity=alt.condition(selection, alt.value(1), alt.value(0.1))
-                ).configure_legend(
-                    orient='top'
-                ).interactive().add_selection(
-                    selection
-                ).to_json())
-
-                chart.data = compact_json(chart.data)
-                charts.append(chart)
 
+def worst_key(aggregate: str, field: str) -> str:
+    return field if aggregate == 'min' else f'{field}_{aggregate}'
 
-    if 'VMAF' in bank.extra_metrics:
-        vmaf_details_df = df.drop(columns=[
-            'stream', 'frame', 'frame_size',
-            'PSNR_Y', 'PSNR_U', 'PSNR_V', 'PSNR_YUV',
-            'SSIM_Y', 'SSIM_U', 'SSIM_V', 'SSIM_YUV',
-            'MSSIM_Y', 'MSSIM_U', 'MSSIM_V', 'MSSIM_YUV',
-            'frame'
-        ])
-
-        worst_vmaf = vmaf_details_df.groupby(['tool', 'br_or_qp']).min().reset_index()
-        worst_vmaf = stream_df.join(worst_vmaf.set_index(['tool', 'br_or_qp'])).reset_index()
-
-        wv = worst_vmaf.rename(columns={'br_or_qp': 'q', 'real_bitrate': 'b'})
-
-        selection = alt.selection_multi(fields=['tool'], bind='legend')
-        chart = Chart('VMAF', alt.Chart(wv).mark_line(point=True, interpolate='monotone').encode(
-            alt.X('b', scale=alt.Scale(zero=False), title='Bitrate (Kb/s)'),
-            alt.Y('VMAF', scale=alt.Scale(zero=False), title='Worst VMAF'),
-            color='tool',
-            tooltip=[
-                alt.Tooltip('b:Q', format=',.1f', title='Bitrate'),
-                alt.Tooltip('VMAF:Q', format='.1f')
-            ],
-            opacity=alt.condition(selection, alt.value(1), alt.value(0.1))
-        ).configure_legend(
-            orient='top'
-        ).interactive().add_selection(
-            selection
-        ).to_json())
-
-        chart.data = compact_json(chart.data)
-        charts.append(chart)
 
-    return charts
+def stream_aggregates(bank: DataBank, stream: Stream) -> pd.DataFrame:
+    aggregates = bank.frame_aggregates()
+    try:
+        return aggregates.xs(stream.name, level='stream')
+    except KeyError:
+        return aggregates.iloc[:0].droplevel('stream')
+
+
+def worst_chart(bank: DataBank, stream: Stream, aggregates: pd.DataFrame, aggregate: str, metric: str,
+                component: Optional[str], options: PageOptions) -> str:
+    field = column_name(metric, component)
+    stream_df = bank.stream_df(stream)[['tool', 'br_or_qp', 'real_bitrate']].set_index(['tool', 'br_or_qp'])
+    worst = aggregates[(aggregate, field)].rename(field)
+    wm = stream_df.join(worst).reset_index().rename(columns={'br_or_qp': 'q', 'real_bitrate': 'b'})
+    md = wm[['tool', 'q', 'b', field]]
+    return chart_spec(md, rd_shape(aggregate_title(aggregate), metric, component), options)
+
 
-def generate_frame_size_charts(bank: DataBank, stream: Stream) -> Dict[str,Any]:
+def generate_worst_charts(bank: DataBank, stream: Stream, options: PageOptions) -> List[Chart]:
     charts = []
-    for tool in bank.tools:
-        br_or_qp = stream.br_or_qp(tool) or bank.br_or_qp(tool)
-
-        for qp in br_or_qp:
-            df = bank.details_df.query(f'stream == "{stream.name}" and br_or_qp == {qp}')
-            columns = set(['stream', 'VMAF',
-                'PSNR_Y', 'PSNR_U', 'PSNR_V', 'PSNR_YUV',
-                'SSIM_Y', 'SSIM_U', 'SSIM_V', 'SSIM_YUV',
-                'MSSIM_Y', 'MSSIM_U', 'MSSIM_V', 'MSSIM_YUV'
-            ])
-            metric_details_df = df.drop(columns=columns)
-            md = metric_details_df.rename(columns={'br_or_qp': 'q', 'frame_size': 's', 'frame': 'f'})
-            selection = alt.selection_multi(fields=['tool'], bind='legend')
-            chart = Chart(
-                f'frame_size_{qp}',
-                alt.Chart(md).mark_line(
-                    point=True, interpolate='monotone'
-                ).encode(
-                    alt.X('f'),
-                    alt.Y('s', scale=alt.Scale(zero=False), title='Frame Size'),
-                    color='tool',
-                    tooltip=[
-                        alt.Tooltip('f:Q', title='Frame'),
-                        alt.Tooltip('s:Q', title='Frame Size'),
-                        alt.Tooltip('q:Q', title='Bitrate or QP'),
-                    ],
-                    opacity=alt.condition(selection, alt.value(1), alt.value(0.1))
-            ).properties(
-                width=1450
-            ).interactive().add_selection(
-                selection
-            ).to_json())
-
-            chart.data = compact_json(chart.data)
-            charts.append(chart)
+
+    aggregates = stream_aggregates(bank, stream)
+    for aggregate in bank.worst_aggregates:
+        for metric, component in charted_metrics(bank):
+            field = column_name(metric, component)
+            if (aggregate, field) not in aggregates.columns:
+                continue
+
+            spec = worst_chart(bank, stream, aggregates, aggregate, metric, component, options)
+            charts.append(Chart(worst_key(aggregate, field), spec))
 
     return charts
 
-def generate_frame_charts(bank: DataBank, stream: Stream) -> Tuple[List[int],List[int],Dict[str,Any]]:
-    charts = []
+
+def rate_points(bank: DataBank, stream: Stream) -> List[Any]:
+    # every rate point charted for the stream, once, even when several tools share it
+    points = []
+    for tool in bank.tools:
+        for qp in stream.br_or_qp(tool) or bank.br_or_qp(tool):
+            if qp not in points:
+                points.append(qp)
+    return points
+
+
+def frame_rate_points(bank: DataBank, stream: Stream) -> Tuple[List[int], List[int]]:
     bitrates = []
     qps = []
     for tool in bank.tools:
-        br_or_qp = stream.br_or_qp(tool) or bank.br_or_qp(tool)
-
         if tool.qp:
-            qps = br_or_qp
+            qps = stream.br_or_qp(tool) or bank.br_or_qp(tool)
         else:
-            bitrates = br_or_qp
-
-        for qp in br_or_qp:
-            df = bank.details_df.query(f'stream == "{stream.name}" and br_or_qp == {qp}')
-            for metric in ['PSNR', 'SSIM', 'MSSIM']:
-                if metric in bank.extra_metrics:
-                    for component in ['Y', 'U', 'V', 'YUV']:
-                        columns = set(['stream', 'VMAF', 'frame_size',
-                            'PSNR_Y', 'PSNR_U', 'PSNR_V', 'PSNR_YUV',
-                            'SSIM_Y', 'SSIM_U', 'SSIM_V', 'SSIM_YUV',
-                            'MSSIM_Y', 'MSSIM_U', 'MSSIM_V', 'MSSIM_YUV'
-                        ])
-                        columns.discard(f'{metric}_{component}')
-                        metric_details_df = df.drop(columns=columns)
-
-                        md = metric_details_df.rename(columns={'br_or_qp': 'q', 'frame': 'f'})
-
-                        selection = alt.selection_multi(fields=['tool'], bind='legend')
-                        tooltip_format = '.2f' if metric == 'PSNR' else '.4f'
-                        chart = Chart(
-                            f'{metric}_{component}_{qp}',
-                            alt.Chart(md).mark_line(
-                                point=True, interpolate='monotone'
-                            ).encode(
-                                alt.X('f'),
-                                alt.Y(
-                                    f'{metric}_{component}',
-                                    scale=alt.Scale(zero=False),
-                                    title=f'{metric} {component}'
-                                ),
-                                color='tool',
-                                tooltip=[
-                                    alt.Tooltip('f:Q', title='Frame'),
-                                    alt.Tooltip(
-                                        f'{metric}_{component}:Q',
-                                        format=tooltip_format,
-                                        title=f'{metric} {component}'
-                                    ),
-                                    alt.Tooltip('q:Q', title='Bitrate or QP'),
-                                ],
-                                opacity=alt.condition(selection, alt.value(1), alt.value(0.1)
-                            )
-                        ).properties(
-                            width=1450
-                        ).interactive().add_selection(
-                            selection
-                        ).to_json())
-
-                        chart.data = compact_json(chart.data)
-                        charts.append(chart)
-
-            if 'VMAF' in bank.extra_metrics:
-                vmaf_details_df = df.drop(columns=[
-                    'stream', 'frame_size',
-                    'PSNR_Y', 'PSNR_U', 'PSNR_V', 'PSNR_YUV',
-                    'SSIM_Y', 'SSIM_U', 'SSIM_V', 'SSIM_YUV',
-                    'MSSIM_Y', 'MSSIM_U', 'MSSIM_V', 'MSSIM_YUV'
-                ])
-
-                vd = vmaf_details_df.rename(columns={'br_or_qp': 'q', 'frame': 'f'})
-                selection = alt.selection_multi(fields=['tool'], bind='legend')
-
-                chart = Chart(f'VMAF_{qp}', alt.Chart(vd).mark_line(point=True, interpolate='monotone').encode(
-                    alt.X('f'),
-                    alt.Y('VMAF', scale=alt.Scale(zero=False)),
-                    color='tool',
-                    tooltip=[
-                        alt.Tooltip('f:Q', title='Frame'),
-                        alt.Tooltip('VMAF:Q', format='.1f'),
-                        alt.Tooltip('q:Q', title='Bitrate or QP'),
-                    ],
-                    opacity=alt.condition(selection, alt.value(1), alt.value(0.1))
-                ).properties(
-                    width=1450
-                ).interactive().add_selection(
-                    selection
-                ).to_json())
-
-                chart.data = compact_json(chart.data)
-                charts.append(chart)
+            bitrates = stream.br_or_qp(tool) or bank.br_or_qp(tool)
+    return bitrates, qps
+
+
+def frame_size_chart(bank: DataBank, stream: Stream, qp, options: PageOptions,
+                     datasets: Optional[Dict[str, str]] = None, df: Optional[pd.DataFrame] = None) -> str:
+    df = bank.frame_details(stream, qp) if df is None else df
+    df = sampled_frames(bank, stream, df, ['frame_size'] if datasets is None else frame_columns(bank, df))
+    md = df.rename(columns={'br_or_qp': 'q', 'frame_size': 's', 'frame': 'f'})[['tool', 'q', 'f', 's']]
+    return frame_spec(bank, md, df, qp, FRAME_SIZE_SHAPE, options, datasets)
+
+
+def generate_frame_size_charts(bank: DataBank, stream: Stream, options: PageOptions,
+                               datasets: Optional[Dict[str, str]] = None) -> List[Chart]:
+    charts = []
+    for qp in rate_points(bank, stream):
+        charts.append(Chart(f'frame_size_{qp}', frame_size_chart(bank, stream, qp, options, datasets)))
+
+    return charts
+
+
+def frame_chart(bank: DataBank, stream: Stream, qp, metric: str, component: Optional[str], options: PageOptions,
+                datasets: Optional[Dict[str, str]] = None, df: Optional[pd.DataFrame] = None) -> str:
+    # with shared datasets df is already sampled for every column
+    df = bank.frame_details(stream, qp) if df is None else df
+    field = column_name(metric, component)
+    fd = df if datasets is not None else sampled_frames(bank, stream, df, [field])
+    md = fd[['tool', 'br_or_qp', 'frame', field]].rename(columns={'br_or_qp': 'q', 'frame': 'f'})
+    return frame_spec(bank, md, fd, qp, frame_shape(metric, component), options, datasets)
+
+
+def generate_frame_charts(bank: DataBank, stream: Stream, options: PageOptions,
+                          datasets: Optional[Dict[str, str]] = None) -> Tuple[List[int],List[int],List[Chart]]:
+    charts = []
+    bitrates, qps = frame_rate_points(bank, stream)
+
+    for qp in rate_points(bank, stream):
+        df = bank.frame_details(stream, qp)
+        if datasets is not None:
+            df = sampled_frames(bank, stream, df, frame_columns(bank, df))
+        for metric, component in charted_metrics(bank):
+            field = column_name(metric, component)
+            if field not in df:
+                continue
+            spec = frame_chart(bank, stream, qp, metric, component, options, datasets, df)
+            charts.append(Chart(f'{field}_{qp}', spec))
 
     return bitrates, qps, charts
 
-def generate_charts(bank: DataBank, charts_folder):
-    alt.data_transformers.disable_max_rows()
-    if not charts_folder:
-        charts_folder = current_folder / 'charts'
-    charts_folder.mkdir(exist_ok=True)
 
-    # loader = jinja2.FileSystemLoader(searchpath=current_folder)
-    # env = jinja2.Environment(loader=loader)
-    # t = env.get_template('template.html')
+def chart_index(bank: DataBank, stream: Stream) -> Dict[str, Dict[str, Callable[[PageOptions], str]]]:
+    # every chart of the page by kind and key, in page order; a spec is only built when its entry is called
+    index = {'mean': {}, 'worst': {}, 'frame': {}, 'frame_size': {}}
+    for metric, component in charted_metrics(bank):
+        index['mean'][column_name(metric, component)] = partial(mean_chart, bank, stream, metric, component)
+
+    if bank.has_details():
+        aggregates = stream_aggregates(bank, stream)
+        for aggregate in bank.worst_aggregates:
+            for metric, component in charted_metrics(bank):
+                field = column_name(metric, component)
+                if (aggregate, field) in aggregates.columns:
+                    index['worst'][worst_key(aggregate, field)] = partial(
+                        worst_chart, bank, stream, aggregates, aggregate, metric, component
+                    )
+
+        for qp in rate_points(bank, stream):
+            for metric, component in charted_metrics(bank):
+                field = column_name(metric, component)
+                if field in bank.details_df:
+                    index['frame'][f'{field}_{qp}'] = partial(frame_chart, bank, stream, qp, metric, component)
+
+    if bank.has_file_sizes:
+        for qp in rate_points(bank, stream):
+            index['frame_size'][f'frame_size_{qp}'] = partial(frame_size_chart, bank, stream, qp)
+
+    return index
+
+
+def page_name(stream: Stream) -> str:
+    return str(Path(stream.name).with_suffix(f'{stream.path.suffix}.html'))
+
+
+def output_options(options: PageOptions) -> Dict[str, Any]:
+    # check_specs only verifies the specs, a page comes out the same with or without it
+    return {name: value for name, value in asdict(options).items() if name != 'check_specs'}
+
+
+def page_digest(bank: DataBank, stream: Stream, options: PageOptions) -> str:
+    inputs = {
+        'version': CHARTS_VERSION,
+        'template': hashlib.md5(template.encode('utf-8')).hexdigest(),
+        'extra_metrics': sorted(bank.extra_metrics),
+        'per_frame_metrics': sorted(bank.per_frame_metrics),
+        'worst_aggregates': bank.worst_aggregates,
+        'downsample': asdict(bank.downsample) if bank.downsample and stream.downsample else None,
+        'has_details': bank.has_details(),
+        'has_file_sizes': bank.has_file_sizes,
+        'options': output_options(options),
+        'tools': [
+            [tool.name, tool.md5, [str(br) for br in stream.br_or_qp(tool) or bank.br_or_qp(tool)]]
+            for tool in bank.tools
+        ],
+        'sources': [
+            [artifact.tool.name, artifact.kind, artifact.path.name, artifact.size, artifact.mtime]
+            for artifact in bank.artifacts if artifact.stream.name == stream.name
+        ],
+    }
+    return hashlib.md5(json.dumps(inputs).encode('utf-8')).hexdigest()
+
+
+def index_digest(digests: List[str], options: PageOptions) -> str:
+    # the index only shows what the pages are built from, so their digests in stream order cover its data
+    inputs = {
+        'version': CHARTS_VERSION,
+        'template': hashlib.md5(index_template.encode('utf-8')).hexdigest(),
+        'options': output_options(options),
+        'pages': digests,
+    }
+    return hashlib.md5(json.dumps(inputs).encode('utf-8')).hexdigest()
+
+
+def load_manifest(charts_folder: Path) -> Dict[str, Any]:
+    try:
+        with (charts_folder / 'manifest.json').open(encoding='utf8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(charts_folder: Path, pages: Dict[str, str], index: str):
+    with (charts_folder / 'manifest.json').open('w', encoding='utf8') as f:
+        json.dump({'pages': pages, 'index': index}, f, indent=2, sort_keys=True)
+
+
+def write_payload(fn: Path, data: str) -> int:
+    fn.parent.mkdir(parents=True, exist_ok=True)
+    payload = gzip.compress(data.encode('utf-8'), mtime=0)
+    fn.write_bytes(payload)
+    return len(payload)
+
+
+def spec_bytes(charts: List[Chart]) -> int:
+    return sum(len(chart.data) for chart in charts)
+
+
+def page_html(bank: DataBank, stream: Stream, payloads: Dict[str, List[Chart]], datasets: Dict[str, str],
+              chart_keys: Dict[str, List[str]], payload_url: Optional[str]) -> str:
+    import jinja2
     env = jinja2.Environment()
     t = env.from_string(template)
 
+    bitrates, qps = frame_rate_points(bank, stream) if bank.has_details() else ([], [])
+    return t.render(
+        mean_charts=payloads['mean'],
+        worst_charts=payloads['worst'],
+        frame_charts=payloads['frame'],
+        frame_sizes_charts=payloads['frame_size'],
+        datasets=datasets,
+        chart_keys=json.dumps(chart_keys),
+        payload_url=json.dumps(payload_url),
+        bitrates=bitrates,
+        qps=qps,
+        worst_aggregates=json.dumps([aggregate for aggregate in bank.worst_aggregates if aggregate != 'min']),
+        available_metrics=list(bank.extra_metrics)
+    )
+
+
+def index_html(bank: DataBank, options: PageOptions) -> str:
+    # the campaign summary: one pass over bank.df for the cross-stream averages and one for the per-stream means
+    import jinja2
+    columns = [column_name(metric, component) for metric, component in charted_metrics(bank)]
+    df = bank.df[['tool', 'stream', 'br_or_qp', 'real_bitrate'] + columns]
+
+    average = df.groupby(['tool', 'br_or_qp'], observed=True, sort=False)[['real_bitrate'] + columns].mean()
+    average = average.reset_index().rename(columns={'br_or_qp': 'q', 'real_bitrate': 'b'})
+    average['tool'] = average['tool'].astype(str)
+
+    specs = {}
+    for metric, component in charted_metrics(bank):
+        shape = rd_shape('Mean over streams', metric, component)
+        spec = named_spec(shape, 'average')
+        if options.check_specs and not same_spec(spec, altair_spec(altair().NamedData(name='average'), shape)):
+            raise ValueError(f'Spec factory output differs from Altair for {shape}')
+        specs[column_name(metric, component)] = json.loads(spec)
+
+    tools = [tool.name for tool in bank.tools]
+    streams = [stream.name for stream in bank.streams]
+    means = df.groupby(['stream', 'tool'], observed=False)[columns].mean()
+    means = means.reindex(pd.MultiIndex.from_product([streams, tools]))
+    values = means.to_numpy(dtype=np.float64).reshape(len(streams), len(tools), len(columns))
+    summary = {
+        'tools': tools,
+        'streams': [{'name': stream.name, 'page': quote(page_name(stream))} for stream in bank.streams],
+        'metrics': columns,
+        'precision': [1 if column == 'VMAF' else 2 if column.startswith('PSNR') else 4 for column in columns],
+        'means': np.where(np.isnan(values), None, np.round(values, 6)).tolist(),
+    }
+
+    t = jinja2.Environment().from_string(index_template)
+    return t.render(
+        average=rows_json(average),
+        specs=json.dumps(specs, separators=(',', ':')),
+        summary=json.dumps(summary, separators=(',', ':')),
+    )
+
+
+def render_page(bank: DataBank, stream: Stream, charts_folder: Path, options: PageOptions):
+    datasets = {} if options.shared_data else None
+    with profiler.stage('mean charts', stream.name) as record:
+        mean_charts = generate_mean_charts(bank, stream, options)
+        record.rows += len(bank.stream_df(stream))
+        record.bytes += spec_bytes(mean_charts)
+
+    worst_charts = {}
+    if bank.has_details():
+        with profiler.stage('worst charts', stream.name) as record:
+            worst_charts = generate_worst_charts(bank, stream, options)
+            record.rows += bank.stream_frame_count(stream)
+            record.bytes += spec_bytes(worst_charts)
+
+    frame_charts = {}
+    if bank.has_details():
+        with profiler.stage('frame charts', stream.name) as record:
+            _, _, frame_charts = generate_frame_charts(bank, stream, options, datasets)
+            record.rows += bank.stream_frame_count(stream)
+            record.bytes += spec_bytes(frame_charts)
+
+    frame_sizes_charts = {}
+    if bank.has_file_sizes:
+        with profiler.stage('frame size charts', stream.name) as record:
+            frame_sizes_charts = generate_frame_size_charts(bank, stream, options, datasets)
+            record.rows += bank.stream_frame_count(stream)
+            record.bytes += spec_bytes(frame_sizes_charts)
+
+    datasets = datasets or {}
+    payloads = {'mean': mean_charts, 'worst': worst_charts, 'frame': frame_charts, 'frame_size': frame_sizes_charts}
+    chart_keys = {kind: [chart.metric for chart in charts] for kind, charts in payloads.items()}
+    chart_keys['datasets'] = list(datasets)
+
+    page = page_name(stream)
+    data_folder = charts_folder / f'{page}.data'
+    shutil.rmtree(data_folder, ignore_errors=True)
+
+    payload_url = None
+    if options.lazy:
+        with profiler.stage('write payloads', stream.name) as record:
+            for kind, charts in payloads.items():
+                for chart in charts:
+                    record.bytes += write_payload(data_folder / kind / f'{chart.metric}.json.gz', chart.data)
+                    record.rows += 1
+            for name, rows in datasets.items():
+                record.bytes += write_payload(data_folder / 'datasets' / f'{name}.json.gz', rows)
+                record.rows += 1
+
+        payload_url = quote(data_folder.name) + '/{kind}/{key}.json.gz'
+        mean_charts, worst_charts, frame_charts, frame_sizes_charts, datasets = [], [], [], [], {}
+
+    with profiler.stage('render template', stream.name) as record:
+        payloads = {'mean': mean_charts, 'worst': worst_charts, 'frame': frame_charts, 'frame_size': frame_sizes_charts}
+        html = page_html(bank, stream, payloads, datasets, chart_keys, payload_url)
+        record.bytes += len(html)
+
+    with profiler.stage('write page', stream.name) as record:
+        record.bytes += (charts_folder / page).write_text(html)
+
+
+def generate_charts(bank: DataBank, charts_folder, force=False, jobs=1, options: Optional[PageOptions] = None):
+    options = options or PageOptions()
+    if not charts_folder:
+        charts_folder = current_folder / 'charts'
+    charts_folder.mkdir(exist_ok=True)
+
+    manifest = load_manifest(charts_folder)
+    pages = manifest.get('pages', {})
+    stale, digests = [], []
     for stream in bank.streams:
-        fn = Path(stream.name).with_suffix(f'{stream.path.suffix}.html')
-        mean_charts = generate_mean_charts(bank, stream)
-
-        worst_charts = {} if bank.details_df.empty else generate_worst_charts(bank, stream)
-
-        frame_charts = {}
-        bitrates = []
-        qps = []
-        if not bank.details_df.empty:
-            bitrates, qps, frame_charts = generate_frame_charts(bank, stream)
-
-        frame_sizes_charts = {}
-        if bank.has_file_sizes:
-            frame_sizes_charts = generate_frame_size_charts(bank, stream)
-
-        html = t.render(
-            mean_charts=mean_charts,
-            worst_charts=worst_charts,
-            frame_charts=frame_charts,
-            frame_sizes_charts=frame_sizes_charts,
-            bitrates=bitrates,
-            qps=qps,
-            available_metrics=list(bank.extra_metrics)
-        )
-        (charts_folder / fn).write_text(html)
+        fn = page_name(stream)
+        digest = page_digest(bank, stream, options)
+        digests.append(digest)
+        if force or pages.get(fn) != digest or not (charts_folder / fn).exists():
+            stale.append((stream, digest))
+    index = index_digest(digests, options)
+
+    if jobs > 1 and len(stale) > 1:
+        if bank.has_details():
+            bank.frame_aggregates()
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            # each worker gets only its stream's rows; keep a bounded number of slices in flight
+            pending = {}
+            queue = iter(stale)
+            while True:
+                for stream, digest in queue:
+                    future = executor.submit(
+                        profiled, profiler.enabled, render_page, bank.slice(stream), stream, charts_folder, options
+                    )
+                    pending[future] = (stream, digest)
+                    if len(pending) >= jobs * 2:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stream, digest = pending.pop(future)
+                    profiler.merge(future.result()[1])
+                    pages[page_name(stream)] = digest
+    else:
+        for stream, digest in stale:
+            render_page(bank, stream, charts_folder, options)
+            pages[page_name(stream)] = digest
+
+    # rendering the index needs altair and jinja2, a run with nothing to rebuild should not import them
+    if force or manifest.get('index') != index or not (charts_folder / 'index.html').exists():
+        with profiler.stage('index page') as record:
+            html = index_html(bank, options)
+            record.rows += len(bank.df)
+            record.bytes += (charts_folder / 'index.html').write_text(html)
+
+    save_manifest(charts_folder, pages, index)
+    print(f'{len(bank.streams) - len(stale)} pages reused, {len(stale)} rebuilt')
+    return charts_folder
@@ -0,0 +1,48 @@
+import numpy as np
+
+
+def envelope(y: np.ndarray, points: int) -> np.ndarray:
+    # split the series into points/2 buckets and keep the lowest and the highest frame of each,
+    # so the worst frames always survive; the first and the last frame keep the x extent
+    n = len(y)
+    if n <= points:
+        return np.arange(n)
+
+    buckets = max(1, (points - 2) // 2)
+    bucket = np.arange(n) * buckets // n
+    order = np.lexsort((np.nan_to_num(y, nan=np.inf), bucket))
+    starts = np.flatnonzero(np.diff(bucket[order], prepend=-1))
+    stops = np.append(starts[1:], n) - 1
+    return np.unique(np.concatenate([[0, n - 1], order[starts], order[stops]]))
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    # Largest-Triangle-Three-Buckets: first and last points are kept, every bucket in between keeps the point
+    # forming the largest triangle with the previously kept point and the average of the next bucket
+    n = len(y)
+    if n <= points or points < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64)
+    y = np.nan_to_num(y.astype(np.float64))
+    edges = (np.arange(points - 1) * (n - 2) // (points - 2) + 1).tolist()
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[stop:next_stop].mean() if next_stop > stop else x[-1]
+        avg_y = y[stop:next_stop].mean() if next_stop > stop else y[-1]
+        area = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(x: np.ndarray, y: np.ndarray, method: str, points: int) -> np.ndarray:
+    # positions of the kept points, in order
+    if method == 'lttb':
+        return lttb(x, y, points)
+    return envelope(y, points)
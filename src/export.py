@@ -0,0 +1,107 @@
+import sys
+import json
+import shutil
+from pathlib import Path
+from urllib.parse import quote
+
+import pandas as pd
+
+from loader import DataBank, configured_bank, artifact_rows, restore_artifacts
+from profiling import profiler
+
+
+# bump when the layout of an export changes
+EXPORT_VERSION = 1
+
+EXPORT_FORMATS = {'parquet': '.parquet', 'feather': '.feather'}
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        sys.exit('Parquet and Feather files need pyarrow, install it with "pip install pyarrow"')
+
+
+def write_table(df: pd.DataFrame, fn: Path, fmt: str):
+    if fmt == 'feather':
+        df.reset_index(drop=True).to_feather(fn)
+    else:
+        df.to_parquet(fn, index=False)
+
+
+def read_table(fn: Path) -> pd.DataFrame:
+    return pd.read_feather(fn) if fn.suffix == '.feather' else pd.read_parquet(fn)
+
+
+def write_export(bank: DataBank, folder: Path, fmt='parquet'):
+    """Writes the loaded tables for use outside generate.py: summary and tools tables, one per-frame table
+    per stream under details/, and export.json with what DataBank.from_export() needs besides them.
+    """
+    require_pyarrow()
+    suffix = EXPORT_FORMATS[fmt]
+    shutil.rmtree(folder / 'details', ignore_errors=True)
+    (folder / 'details').mkdir(parents=True)
+
+    tools = pd.DataFrame({
+        'name': [tool.name for tool in bank.tools],
+        'label': [tool.label for tool in bank.tools],
+        'qp': [tool.qp for tool in bank.tools],
+        'command_line': [tool.command_line for tool in bank.tools],
+        'md5': [tool.md5 for tool in bank.tools],
+    })
+    with profiler.stage('write export') as record:
+        write_table(tools, folder / f'tools{suffix}', fmt)
+        write_table(bank.df, folder / f'summary{suffix}', fmt)
+        record.rows += len(bank.df)
+
+        details = {}
+        if bank.has_details():
+            for stream in bank.streams:
+                df = bank.stream_details(stream)
+                if df.empty:
+                    continue
+                details[stream.name] = f'details/{quote(stream.name, safe="")}{suffix}'
+                write_table(df, folder / details[stream.name], fmt)
+                record.rows += len(df)
+
+    with (folder / 'export.json').open('w', encoding='utf8') as f:
+        json.dump({
+            'version': EXPORT_VERSION,
+            'config': bank.config,
+            'tools': [tool.name for tool in bank.tools],
+            'streams': [stream.name for stream in bank.streams],
+            'summary': f'summary{suffix}',
+            'details': details,
+            'has_file_sizes': bank.has_file_sizes,
+            'artifacts': artifact_rows(bank.artifacts),
+        }, f, indent=2)
+
+
+def read_export(folder: Path) -> DataBank:
+    try:
+        with (folder / 'export.json').open(encoding='utf8') as f:
+            export = json.load(f)
+    except (OSError, ValueError) as e:
+        sys.exit(f'Unable to read the export in "{folder}": {e}')
+    if export.get('version') != EXPORT_VERSION:
+        sys.exit(f'"{folder}" is not an export written by this version of generate.py')
+    require_pyarrow()
+
+    bank = configured_bank(export['config'], export['tools'], export['streams'])
+    bank.has_file_sizes = export['has_file_sizes']
+    bank.artifacts = restore_artifacts(bank, export['artifacts'])
+
+    with profiler.stage('read export') as record:
+        categories = {'tool': 'category', 'stream': 'category'}
+        bank.df = read_table(folder / export['summary']).astype(categories)
+        # streams in configuration order, as a fresh load has them
+        frames = [read_table(folder / export['details'][stream.name])
+                  for stream in bank.streams if stream.name in export['details']]
+        if frames:
+            bank.details_df = pd.concat(frames, ignore_index=True).astype(categories)
+        record.rows += len(bank.df) + len(bank.details_df)
+
+    bank._build_index()
+    print(f'{len(bank.df)} summary and {len(bank.details_df)} per-frame rows read from {folder}')
+    return bank
@@ -0,0 +1,92 @@
+import os
+import json
+from pathlib import Path
+from typing import Dict, List, Any, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class FrameStore:
+    """Per-frame columns kept on disk, one fixed-dtype array file per column, memory-mapped for reading.
+
+    Every details file becomes a segment, a (tool, stream, br_or_qp) row range in the offsets table, so
+    a slice of frames is read without touching the rest. Files are only appended to; replaced segments
+    are dropped from the table and their rows stay unused until the store is recreated.
+    """
+    def __init__(self, folder: Path, dtypes: Dict[str, str]):
+        self.folder = folder
+        self.dtypes = dtypes
+        self.segments: List[Tuple[str, str, Any, int, int]] = []
+        self.rows = 0
+        self._files = {}
+        self._arrays = {}
+
+        folder.mkdir(parents=True, exist_ok=True)
+        for column in dtypes:
+            self.path(column).unlink(missing_ok=True)
+
+    def __getstate__(self):
+        # worker processes map the files again on first read
+        state = self.__dict__.copy()
+        state['_files'] = {}
+        state['_arrays'] = {}
+        return state
+
+    def path(self, column: str) -> Path:
+        return self.folder / f'{column}.bin'
+
+    def append(self, tool: str, stream: str, br, columns: Dict[str, np.ndarray]):
+        count = len(next(iter(columns.values()), []))
+        for column, dtype in self.dtypes.items():
+            if column not in self._files:
+                self._files[column] = self.path(column).open('ab')
+            values = columns.get(column)
+            values = np.full(count, np.nan, dtype=dtype) if values is None else np.asarray(values, dtype=dtype)
+            self._files[column].write(values.tobytes())
+
+        self.segments.append((tool, stream, br, self.rows, self.rows + count))
+        self.rows += count
+        self._arrays = {}
+
+    def flush(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        self._arrays = {}
+        with (self.folder / 'offsets.json').open('w') as f:
+            json.dump({'rows': self.rows, 'dtypes': self.dtypes, 'segments': self.segments}, f)
+
+    def remove_streams(self, names: List[str]):
+        self.segments = [segment for segment in self.segments if segment[1] not in names]
+
+    def column(self, column: str) -> np.ndarray:
+        if column not in self._arrays:
+            dtype = np.dtype(self.dtypes[column])
+            if self.rows and os.path.getsize(self.path(column)) >= self.rows * dtype.itemsize:
+                self._arrays[column] = np.memmap(self.path(column), dtype=dtype, mode='r', shape=(self.rows,))
+            else:
+                self._arrays[column] = np.empty(0, dtype=dtype)
+        return self._arrays[column]
+
+    def read(self, stream: str, br=None) -> pd.DataFrame:
+        # the frames of one stream, of one of its rate points when br is given, in the row order of an
+        # in-memory details frame: by rate point, then load order
+        segments = [segment for segment in self.segments if segment[1] == stream and (br is None or segment[2] == br)]
+        segments.sort(key=lambda segment: segment[2])
+        tools = sorted({segment[0] for segment in self.segments})
+        streams = sorted({segment[1] for segment in self.segments})
+
+        lengths = [stop - start for _, _, _, start, stop in segments]
+        frame = {
+            'tool': pd.Categorical(np.repeat([segment[0] for segment in segments], lengths), categories=tools),
+            'stream': pd.Categorical(np.repeat([stream] * len(segments), lengths), categories=streams),
+            'br_or_qp': np.repeat([segment[2] for segment in segments], lengths),
+            'frame': np.concatenate([np.arange(count, dtype=np.int32) for count in lengths] or [[]]).astype(np.int32),
+        }
+        for column in self.dtypes:
+            array = self.column(column)
+            chunks = [array[start:stop] for _, _, _, start, stop in segments]
+            frame[column] = np.concatenate(chunks) if chunks else np.empty(0, dtype=self.dtypes[column])
+        return pd.DataFrame(frame)
+
@@ -1,11 +1,12 @@
 import sys
 import argparse
+import importlib.util
+import multiprocessing
 from pathlib import Path
 
 import yaml
 
-from loader import load_data
-from charts import generate_charts
+from profiling import profiler
 
 
 if getattr(sys, 'frozen', False):
@@ -14,6 +15,8 @@ else:
     current_folder = Path(__file__).parent
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
+
     parser = argparse.ArgumentParser(description="Zero-config chart generator")
     parser.add_argument('config', nargs='?', default='edc.yaml', help='configuration file in yaml format.'
                                                             ' (default: %(default)s)')
@@ -21,18 +24,105 @@ if __name__ == '__main__':
                                                             ' (default: the same directory as config\'s one)')
     parser.add_argument('--charts', required=False, help='Path to output charts directory.'
                                                             ' (default: the charts directory)')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of worker processes used to parse artifacts'
+                                                            ' and to render pages.'
+                                                            ' (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true', help='Parse every artifact instead of reusing'
+                                                            ' the parsed values kept next to the tool folders.')
+    parser.add_argument('--force', action='store_true', help='Rebuild every page, even those whose inputs'
+                                                            ' did not change since the previous run.')
+    parser.add_argument('--frame-store', help='Keep the per-frame data in memory-mapped column files in this'
+                                                            ' directory instead of in memory.')
+    parser.add_argument('--shared-data', action='store_true', help='Embed the per-frame rows of each rate point once'
+                                                            ' and let all frame charts of the page reference them.')
+    parser.add_argument('--lazy', action='store_true', help='Write each chart to its own gzipped JSON file next to'
+                                                            ' the page and fetch it only when shown.'
+                                                            ' Such pages have to be opened through a web server.')
+    parser.add_argument('--check-specs', action='store_true', help='Also build every chart of the rebuilt pages'
+                                                            ' through Altair and stop if the generated spec differs,'
+                                                            ' add --force to check all pages.')
+    parser.add_argument('--watch', action='store_true', help='Keep running, poll the tool folders for new or changed'
+                                                            ' results and rebuild the pages of the affected streams.')
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between two polls in watch mode.'
+                                                            ' (default: %(default)s)')
+    parser.add_argument('--debounce', type=float, default=5.0, help='Seconds without further changes before a'
+                                                            ' rebuild starts in watch mode. (default: %(default)s)')
+    parser.add_argument('--serve', action='store_true', help='Instead of writing pages, serve them from a local web'
+                                                            ' server that builds each chart when it is shown.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address the server listens on. (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8000, help='Port the server listens on. (default: %(default)s)')
+    parser.add_argument('--cache-size', type=int, default=256, help='Number of chart specs the server keeps.'
+                                                            ' (default: %(default)s)')
+    parser.add_argument('--bd-rate', action='store_true', help='Also write the BD-rate and BD-quality of every tool'
+                                                            ' pair, stream and metric to bd-rate.html and bd-rate.csv'
+                                                            ' in the charts directory.')
+    parser.add_argument('--baseline', help='Label of the tool every other one is compared with by --bd-rate,'
+                                                            ' a cqp tool is <label>.qp. (default: all pairs)')
+    parser.add_argument('--streams', help='Comma separated stream name patterns, only matching streams are loaded.')
+    parser.add_argument('--tools', help='Comma separated tool label patterns, only matching tools are loaded.')
+    parser.add_argument('--shard', help='K/N: load only the K-th of N partitions of the streams, split by a hash'
+                                                            ' of the stream name.')
+    parser.add_argument('--shard-output', help='Write the loaded rows and aggregates to this file for a later'
+                                                            ' --merge instead of generating pages.')
+    parser.add_argument('--merge', nargs='+', metavar='SHARD', help='Generate the pages from these --shard-output'
+                                                            ' files instead of the artifacts, the config is not read.')
+    parser.add_argument('--export', metavar='DIR', help='Write the loaded summary, per-frame and tool tables to'
+                                                            ' this directory instead of generating pages.'
+                                                            ' Needs pyarrow.')
+    parser.add_argument('--export-format', choices=['parquet', 'feather'], default='parquet', help='File format of'
+                                                            ' --export. (default: %(default)s)')
+    parser.add_argument('--from-export', metavar='DIR', help='Generate the pages from an --export directory instead'
+                                                            ' of the artifacts, the config is not read.')
+    parser.add_argument('--profile', action='store_true', help='Time every loading and rendering stage, print a'
+                                                            ' summary and write profile.json to the charts directory.')
 
     args = parser.parse_args()
+    if args.serve and args.watch:
+        parser.error('--serve and --watch can not be combined')
+    if args.serve and args.bd_rate:
+        parser.error('--serve and --bd-rate can not be combined')
+    if args.baseline and not args.bd_rate:
+        parser.error('--baseline only applies to --bd-rate')
+    if args.merge and (args.watch or args.shard_output or args.streams or args.tools or args.shard):
+        parser.error('--merge can not be combined with --watch, --shard-output or a shard selection')
+    if args.shard_output and (args.watch or args.serve):
+        parser.error('--shard-output can not be combined with --watch or --serve')
+    if args.export and (args.watch or args.serve or args.shard_output):
+        parser.error('--export can not be combined with --watch, --serve or --shard-output')
+    if args.from_export and (args.merge or args.watch or args.frame_store or args.streams or args.tools
+                             or args.shard):
+        parser.error('--from-export can not be combined with --merge, --watch, --frame-store or a shard selection')
+    if (args.export or args.from_export) and importlib.util.find_spec('pyarrow') is None:
+        sys.exit('--export and --from-export need pyarrow, install it with "pip install pyarrow"')
 
-    config = Path(args.config)
-    if not config.is_absolute():
-        config = current_folder / config
+    selection = None
+    if args.streams or args.tools or args.shard:
+        index, count = 1, 1
+        if args.shard:
+            try:
+                index, count = (int(part) for part in args.shard.split('/'))
+            except ValueError:
+                parser.error(f'--shard takes K/N, got "{args.shard}"')
+            if not 1 <= index <= count:
+                parser.error(f'--shard K/N needs 1 <= K <= N, got "{args.shard}"')
+        selection = dict(
+            streams=tuple(pattern.strip() for pattern in (args.streams or '').split(',') if pattern.strip()),
+            tools=tuple(pattern.strip() for pattern in (args.tools or '').split(',') if pattern.strip()),
+            index=index, count=count
+        )
+    profiler.enabled = args.profile
 
-    if not config.exists():
-        sys.exit(f'Configuration file "{config}" not found')
+    cfg = None
+    if not args.merge and not args.from_export:
+        config = Path(args.config)
+        if not config.is_absolute():
+            config = current_folder / config
 
-    with config.open(encoding='utf8') as f:
-        cfg = yaml.safe_load(f)
+        if not config.exists():
+            sys.exit(f'Configuration file "{config}" not found')
+
+        with config.open(encoding='utf8') as f:
+            cfg = yaml.safe_load(f)
 
     # where .cache and other artifacts are located
     artifacts_path = None
@@ -46,6 +136,65 @@ if __name__ == '__main__':
         charts_path = Path(args.charts)
 
 
-    bank = load_data(cfg, artifacts_path)
+    # pandas, altair and jinja2 come with these, so --help and configuration errors don't wait for them
+    from loader import DataBank, load_data, Shard
+    from charts import generate_charts, PageOptions
+
+    frame_store = Path(args.frame_store) if args.frame_store else None
+    with profiler.stage('load data'):
+        if args.from_export:
+            bank = DataBank.from_export(Path(args.from_export))
+        elif args.merge:
+            from shard import merge_shards
+            bank = merge_shards([Path(fn) for fn in args.merge], frame_store=frame_store)
+        else:
+            bank = load_data(cfg, artifacts_path, jobs=max(1, args.jobs), use_cache=not args.no_cache,
+                             frame_store=frame_store, shard=Shard(**selection) if selection else None)
+
+    if args.shard_output:
+        from shard import save_shard
+        with profiler.stage('write shard'):
+            save_shard(bank, Path(args.shard_output))
+        print(f'{len(bank.tools)} tools and {len(bank.streams)} streams written to {args.shard_output}')
+        if args.profile:
+            profiler.print_summary()
+        sys.exit()
+
+    if args.export:
+        from export import write_export
+        write_export(bank, Path(args.export), args.export_format)
+        print(f'{len(bank.tools)} tools and {len(bank.streams)} streams exported to {args.export}')
+        if args.profile:
+            profiler.print_summary()
+        sys.exit()
+
+    if args.bd_rate:
+        from bdrate import bd_rates
+        with profiler.stage('bd-rate'):
+            try:
+                bd_table = bd_rates(bank, args.baseline)
+            except ValueError as e:
+                sys.exit(str(e))
+
+    options = PageOptions(shared_data=args.shared_data, lazy=args.lazy, check_specs=args.check_specs)
+    if args.serve:
+        from serve import serve
+        serve(bank, host=args.host, port=args.port, cache_size=max(1, args.cache_size), options=options)
+        sys.exit()
+
+    with profiler.stage('generate charts'):
+        charts_path = generate_charts(bank, charts_path, force=args.force, jobs=max(1, args.jobs), options=options)
+
+    if args.bd_rate:
+        from bdrate import write_report
+        write_report(bd_table, charts_path)
+        print(f'BD-rate of {len(bd_table)} tool pair, stream and metric combinations written to {charts_path}')
+
+    if args.profile:
+        profiler.print_summary()
+        profiler.save(charts_path / 'profile.json')
 
-    generate_charts(bank, charts_path)
+    if args.watch:
+        from watch import watch
+        watch(bank, charts_path, interval=args.interval, debounce=args.debounce, jobs=max(1, args.jobs),
+              use_cache=not args.no_cache, options=options)
@@ -1,14 +1,33 @@
+import os
+import re
 import sys
+import copy
+import contextlib
+import struct
 import hashlib
+import zipfile
+import tempfile
+from array import array
 from pathlib import Path
-from typing import List, Dict, Any, Union
+from typing import List, Dict, Any, Iterator, Optional, Tuple, Union
+from dataclasses import dataclass
+from itertools import repeat
+from fnmatch import fnmatch
 from functools import cached_property
+from concurrent.futures import ProcessPoolExecutor
 
 import yaml
-from num2words import num2words
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
+import numpy as np
 import pandas as pd
 
+from profiling import profiler, profiled
+from framestore import FrameStore
+
 
 if getattr(sys, 'frozen', False):
     current_folder = Path(sys.argv[0]).parent
@@ -16,6 +35,66 @@ else:
     current_folder = Path(__file__).parent
 
 
+METRICS = ['PSNR', 'SSIM', 'MSSIM']
+COMPONENTS = ['Y', 'U', 'V', 'YUV']
+METRIC_COLUMNS = ['VMAF'] + [f'{metric}_{component}' for metric in METRICS for component in COMPONENTS]
+
+# per-frame aggregates over a (tool, stream, rate point); 'min' is the classic worst-frame chart,
+# 'p<N>' is the N-th percentile and 'hmean' (harmonic mean) only applies to VMAF
+AGGREGATES = ['min', 'std', 'hmean']
+
+# long per-frame series are reduced to a few thousand points: 'envelope' keeps the lowest and highest
+# frame of every bucket, 'lttb' is Largest-Triangle-Three-Buckets
+DOWNSAMPLE_METHODS = ['envelope', 'lttb']
+
+
+def is_aggregate(aggregate: str) -> bool:
+    # aggregates become JavaScript property names in the page, so a percentile is a whole number
+    if re.fullmatch(r'p[0-9]{1,3}', aggregate):
+        return int(aggregate[1:]) <= 100
+    return aggregate in AGGREGATES
+
+
+def metric_columns(metrics) -> List[str]:
+    return [column for column in METRIC_COLUMNS if column.split('_')[0] in metrics]
+
+
+def aggregate_frames(details_df: pd.DataFrame, aggregates: List[str]) -> pd.DataFrame:
+    keys = ['stream', 'tool', 'br_or_qp']
+    columns = [column for column in METRIC_COLUMNS if column in details_df]
+    frame = details_df[keys + columns]
+    if 'hmean' in aggregates and 'VMAF' in columns:
+        with np.errstate(divide='ignore'):
+            frame = frame.assign(inverse_VMAF=1 / details_df['VMAF'].astype(np.float64))
+
+    # one grouping of the whole table, every aggregate reuses it
+    grouped = frame.groupby(keys, observed=True)
+    parts = {}
+    for aggregate in aggregates:
+        if aggregate == 'min':
+            parts[aggregate] = grouped[columns].min()
+        elif aggregate == 'std':
+            parts[aggregate] = grouped[columns].std()
+        elif aggregate == 'hmean':
+            if 'VMAF' in columns:
+                parts[aggregate] = (grouped['VMAF'].count() / grouped['inverse_VMAF'].sum()).to_frame('VMAF')
+        else:
+            parts[aggregate] = grouped[columns].quantile(float(aggregate[1:]) / 100)
+
+    return pd.concat(parts, axis=1)
+
+
+def build_frame(columns: Dict[str, list]) -> pd.DataFrame:
+    dtypes = {
+        'tool': 'category', 'stream': 'category', 'frame': 'int32', 'real_bitrate': 'float64', 'frame_size': 'float64'
+    }
+    dtypes.update({column: 'float32' for column in METRIC_COLUMNS})
+    return pd.DataFrame({
+        column: pd.Series(values if column in dtypes else np.asarray(values), dtype=dtypes.get(column))
+        for column, values in columns.items()
+    })
+
+
 class Tool:
     def __init__(self, tool: Dict[str, str], artifacts_path, qp):
         self.label = tool['label']
@@ -38,6 +117,10 @@ class Tool:
         cache = self.artifacts_path / '.cache'
         return cache / f'{self.name}.{self.md5}'
 
+    @cached_property
+    def parsed_cache(self):
+        return self.folder.parent / f'{self.folder.name}.npz'
+
     def __str__(self):
         return self.name
 
@@ -47,6 +130,7 @@ class Stream:
         self.path = Path(stream['stream'])
         self.qp = stream.get('qp', [])
         self.bitrates = stream.get('bitrates', [])
+        self.downsample = bool(stream.get('downsample', True))
 
     def br_or_qp(self, tool: Tool):
         return self.qp if tool.qp else self.bitrates
@@ -59,34 +143,280 @@ class Stream:
         return self.name
 
 
+@dataclass(frozen=True)
+class Downsample:
+    method: str = 'envelope'
+    points: int = 3000
+
+
+@dataclass(frozen=True)
+class Shard:
+    # the part of a campaign one build node loads: streams and tool labels matching any of the fnmatch
+    # patterns (all when empty), then the index-th of count partitions of the streams by name hash
+    streams: Tuple[str, ...] = ()
+    tools: Tuple[str, ...] = ()
+    index: int = 1
+    count: int = 1
+
+
+@dataclass
+class Artifact:
+    kind: str
+    tool: Tool
+    stream: Stream
+    br: int
+    path: Path
+    size: int
+    mtime: int
+
+
+# rows of a column ArtifactCache reads from the sidecar at once
+CACHE_READ_AHEAD = 1 << 14
+
+
+class ArtifactCache:
+    """Parsed summary/details values of one tool folder, kept in a .npz sidecar next to it.
+
+    Entries are keyed on file name, size and mtime. All entries share one set of float64 columns,
+    a summary file takes one row and a details file takes one row per frame. Only the columns of
+    the metrics parsed for are kept, a cache made for fewer metrics than requested is not used.
+
+    Only the index is held in memory: an entry is read from the sidecar when asked for, through one
+    read-ahead window per column since entries are mostly asked for in the order they were written,
+    and new entries are spilled to a temporary file; save() copies both into the new sidecar entry by
+    entry. The sidecar stays open until close().
+    """
+    def __init__(self, tool: Tool, metrics):
+        self.path = tool.parsed_cache
+        self.folder = tool.folder
+        self.metrics = sorted(metrics)
+        self.columns = metric_columns(self.metrics) + ['frame_size', 'real_bitrate']
+        # name -> (size, mtime, file the values are in, start row there, row count)
+        self.entries = {}
+        # where each column's float64 data starts in the sidecar, it is an uncompressed .npz
+        self.data_offsets = {}
+        self.rows = 0
+        # column -> (first row, the values read ahead from there)
+        self.windows = {}
+        self.file = None
+        self.spill = None
+        self.spilled = 0
+        self.writable = True
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        self.entries = {}
+        if not self.path.exists():
+            return
+
+        try:
+            self.file = self.path.open('rb')
+            with np.load(self.file, allow_pickle=False) as npz:
+                if 'metrics' not in npz.files or not set(self.metrics) <= set(npz['metrics'].tolist()):
+                    self.close()
+                    return
+                names, sizes, mtimes, offsets = npz['names'], npz['sizes'], npz['mtimes'], npz['offsets']
+                self.data_offsets = {column: npy_data_offset(npz.zip, self.file, column) for column in self.columns}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            print(f'Ignoring unreadable cache "{self.path}": {e}', file=sys.stderr)
+            self.close()
+            return
+
+        for i, name in enumerate(names):
+            start, stop = int(offsets[i]), int(offsets[i + 1])
+            self.entries[str(name)] = (int(sizes[i]), int(mtimes[i]), None, start, stop - start)
+        self.rows = int(offsets[-1])
+
+    def has(self, artifact: Artifact) -> bool:
+        entry = self.entries.get(artifact.path.name)
+        return entry is not None and entry[:2] == (artifact.size, artifact.mtime)
+
+    def read(self, entry, columns: List[str]) -> Dict[str, np.ndarray]:
+        _, _, source, start, count = entry
+        if source is None:
+            return {column: self.read_rows(column, start, count) for column in columns}
+        # spilled entries are their columns back to back
+        return {column: read_float64(source, start + self.columns.index(column) * count * 8, count)
+                for column in columns}
+
+    def read_rows(self, column: str, start: int, count: int) -> np.ndarray:
+        first, window = self.windows.get(column, (0, None))
+        if window is None or start < first or start + count > first + len(window):
+            rows = min(max(count, CACHE_READ_AHEAD), self.rows - start)
+            first, window = start, read_float64(self.file, self.data_offsets[column] + start * 8, rows)
+            self.windows[column] = (first, window)
+        return window[start - first:start - first + count]
+
+    def get(self, artifact: Artifact):
+        if not self.has(artifact):
+            return None
+
+        values = {column: array for column, array in self.read(self.entries[artifact.path.name], self.columns).items()
+                  if not all_nan(array)}
+        if artifact.kind == 'details':
+            return {column: array for column, array in values.items() if column != 'real_bitrate'}
+        return {column: float(array[0]) for column, array in values.items()}
+
+    def put(self, artifact: Artifact, data):
+        if artifact.kind == 'details':
+            count = len(next(iter(data.values()), []))
+            values = [np.asarray(data.get(column, [np.nan] * count), dtype=np.float64) for column in self.columns]
+        else:
+            count = 1
+            values = [np.array([data.get(column, np.nan)], dtype=np.float64) for column in self.columns]
+
+        if not self.writable:
+            return
+        start = self.spilled
+        try:
+            if self.spill is None:
+                self.spill = tempfile.TemporaryFile(dir=self.path.parent)
+            for column in values:
+                self.spill.write(column.tobytes())
+        except OSError as e:
+            print(f'Unable to write cache "{self.path}": {e}', file=sys.stderr)
+            self.writable = False
+            return
+        self.spilled += count * len(self.columns) * 8
+        self.entries[artifact.path.name] = (artifact.size, artifact.mtime, self.spill, start, count)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        present = set(os.listdir(self.folder))
+        entries = [(name, entry) for name, entry in self.entries.items() if name in present]
+        lengths = [entry[4] for _, entry in entries]
+
+        arrays = {
+            'metrics': np.array(self.metrics, dtype=str),
+            'names': np.array([name for name, _ in entries], dtype=str),
+            'sizes': np.array([entry[0] for _, entry in entries], dtype=np.int64),
+            'mtimes': np.array([entry[1] for _, entry in entries], dtype=np.int64),
+            'offsets': np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).astype(np.int64),
+        }
+
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        try:
+            # the same layout np.savez() writes, with the columns copied one entry at a time
+            with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+                for name, array in arrays.items():
+                    with zf.open(f'{name}.npy', 'w', force_zip64=True) as out:
+                        np.lib.format.write_array(out, array)
+                for column in self.columns:
+                    with zf.open(f'{column}.npy', 'w', force_zip64=True) as out:
+                        np.lib.format.write_array_header_1_0(out, {
+                            'descr': np.lib.format.dtype_to_descr(np.dtype(np.float64)),
+                            'fortran_order': False,
+                            'shape': (sum(lengths),),
+                        })
+                        for _, entry in entries:
+                            out.write(self.read(entry, [column])[column].tobytes())
+            self.close()
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f'Unable to write cache "{self.path}": {e}', file=sys.stderr)
+        self.dirty = False
+        self.close()
+        self.load()
+
+    def close(self):
+        self.windows = {}
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.spill is not None:
+            self.spill.close()
+            self.spill, self.spilled = None, 0
+
+
+def npy_data_offset(zf: zipfile.ZipFile, f, name: str) -> int:
+    # where the values of an uncompressed float64 member start in the .npz file
+    info = zf.getinfo(f'{name}.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f'{name} is compressed')
+    f.seek(info.header_offset)
+    header = f.read(30)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    f.seek(info.header_offset + 30 + name_length + extra_length)
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    if dtype != np.float64 or len(shape) != 1:
+        raise ValueError(f'{name} is not a float64 column')
+    return f.tell()
+
+
+def all_nan(values: np.ndarray) -> bool:
+    # a column that has a value usually has one in its first row, so most columns are not scanned
+    return not len(values) or (values[0] != values[0] and np.isnan(values).all())
+
+
+def read_float64(f, offset: int, count: int) -> np.ndarray:
+    f.seek(offset)
+    return np.frombuffer(f.read(count * 8), dtype=np.float64)
+
+
 class DataBank:
     def __init__(self):
         self.tools: List[Tool] = []
         self.streams: List[Stream] = []
+        # the configuration the bank was loaded for, kept for shards and exports
+        self.config: Dict[str, Any] = {}
 
         self.common_bitrates = []
         self.common_qp = []
         self.extra_metrics = set(['PSNR'])
         self.per_frame_metrics = set()
         self.has_file_sizes = False
-
-        self.df = pd.DataFrame(columns=[
-            'tool', 'stream', 'br_or_qp',
-            'VMAF',
-            'PSNR_Y', 'PSNR_U', 'PSNR_V', 'PSNR_YUV',
-            'SSIM_Y', 'SSIM_U', 'SSIM_V', 'SSIM_YUV',
-            'MSSIM_Y', 'MSSIM_U', 'MSSIM_V', 'MSSIM_YUV',
-            'real_bitrate'
-        ])
-
-        self.details_df = pd.DataFrame(columns=[
-            'tool', 'stream', 'br_or_qp', 'frame',
-            'VMAF',
-            'PSNR_Y', 'PSNR_U', 'PSNR_V', 'PSNR_YUV',
-            'SSIM_Y', 'SSIM_U', 'SSIM_V', 'SSIM_YUV',
-            'MSSIM_Y', 'MSSIM_U', 'MSSIM_V', 'MSSIM_YUV',
-            'frame_size'
-        ])
+        self.worst_aggregates = ['min']
+        self.downsample: Optional[Downsample] = None
+        self.artifacts: List[Artifact] = []
+        self.frame_store: Optional[FrameStore] = None
+
+        self._records = {}
+        self._details = {}
+
+        self.df = build_frame({column: [] for column in self.summary_columns()})
+        self.details_df = build_frame({column: [] for column in self.details_columns()})
+        self._build_index()
+        self._frame_aggregates = None
+
+    @classmethod
+    def from_export(cls, folder: Path) -> 'DataBank':
+        # the tables written by generate.py --export, read back without touching any artifact
+        from export import read_export
+        return read_export(folder)
+
+    def metrics(self):
+        # only the requested metrics are parsed and kept, the others are never materialized
+        return self.extra_metrics | self.per_frame_metrics
+
+    def summary_columns(self) -> List[str]:
+        return ['tool', 'stream', 'br_or_qp'] + metric_columns(self.metrics()) + ['real_bitrate']
+
+    def details_columns(self) -> List[str]:
+        return ['tool', 'stream', 'br_or_qp', 'frame'] + metric_columns(self.metrics()) + ['frame_size']
+
+    def use_frame_store(self, folder: Path):
+        # per-frame data goes to memory-mapped column files instead of details_df, which then stays empty
+        dtypes = {column: 'float32' for column in metric_columns(self.metrics())}
+        dtypes['frame_size'] = 'float64'
+        self.frame_store = FrameStore(folder, dtypes)
+
+    def has_details(self) -> bool:
+        if self.frame_store is not None:
+            return bool(self.frame_store.segments)
+        return not self.details_df.empty
+
+    def frame_count(self) -> int:
+        if self.frame_store is not None:
+            return sum(stop - start for _, _, _, start, stop in self.frame_store.segments)
+        return len(self.details_df)
 
     def br_or_qp(self, tool: Tool):
         return self.common_qp if tool.qp else self.common_bitrates
@@ -97,64 +427,266 @@ class DataBank:
     def add_stream(self, stream: Stream):
         self.streams.append(stream)
 
-    def _update_record(self, record: Dict[str, Union[str,float]], metric: str, section: Dict[str,Any]) -> None:
-        if metric in section:
-            y = section[metric]['Y']
-            u = section[metric]['U']
-            v = section[metric]['V']
-            yuv = (4*y + u + v) / 6
-            record.update({
+    def add_summary(self, tool: Tool, stream: Stream, br: int, record: Dict[str, float]):
+        record = dict(record, tool=tool.name, stream=stream.name, br_or_qp=br)
+        for column in self.summary_columns():
+            self._records.setdefault(column, []).append(record.get(column, np.nan))
+
+    def add_details(self, tool: Tool, stream: Stream, br: int, columns: Dict[str, np.ndarray]):
+        count = len(next(iter(columns.values()), []))
+        if 'frame_size' in columns:
+            self.has_file_sizes = True
+
+        if self.frame_store is not None:
+            self.frame_store.append(tool.name, stream.name, br, columns)
+            return
+
+        # details are buffered as one array per file and column, concatenated in finalize()
+        columns = dict(
+            columns,
+            tool=np.full(count, tool.name, dtype=object),
+            stream=np.full(count, stream.name, dtype=object),
+            br_or_qp=np.full(count, br),
+            frame=np.arange(count, dtype=np.int32)
+        )
+        for column in self.details_columns():
+            self._details.setdefault(column, []).append(np.asarray(columns.get(column, np.full(count, np.nan))))
+
+    def add_artifact(self, artifact: Artifact, data):
+        if artifact.kind == 'details':
+            self.add_details(artifact.tool, artifact.stream, artifact.br, data)
+        else:
+            self.add_summary(artifact.tool, artifact.stream, artifact.br, data)
+
+    def finalize(self):
+        self.df = build_frame({column: self._records.get(column, []) for column in self.summary_columns()})
+        self.details_df = build_frame({
+            column: np.concatenate(self._details[column]) if self._details.get(column) else []
+            for column in self.details_columns()
+        })
+        self._records = {}
+        self._details = {}
+        if self.frame_store is not None:
+            self.frame_store.flush()
+        self._build_index()
+        self._frame_aggregates = None
+
+    def replace_streams(self, streams: List[Stream], artifacts: List[Artifact], parsed: List[Dict[str, Any]]):
+        # the rows of these streams are rebuilt from the given artifacts, the other streams are kept as they are
+        names = [stream.name for stream in streams]
+        df, details_df = self.df, self.details_df
+        if self.frame_store is not None:
+            self.frame_store.remove_streams(names)
+        for artifact, data in zip(artifacts, parsed):
+            self.add_artifact(artifact, data)
+        self.finalize()
+
+        def merged(old, new):
+            frame = pd.concat([old[~old['stream'].isin(names)], new], ignore_index=True)
+            return frame.astype({'tool': 'category', 'stream': 'category'})
+
+        self.df = merged(df, self.df)
+        self.details_df = merged(details_df, self.details_df)
+        self._build_index()
+
+    def _build_index(self):
+        # details are kept sorted by (stream, br_or_qp), load order within, so every
+        # stream and every (stream, rate point) is one contiguous row range
+        self.details_df = self.details_df.sort_values(['stream', 'br_or_qp'], kind='stable', ignore_index=True)
+        self._stream_rows = self.df.groupby('stream', observed=True).indices
+
+        streams = self.details_df['stream']
+        codes = streams.cat.codes.to_numpy()
+        brs = self.details_df['br_or_qp'].to_numpy()
+        stream_starts = np.flatnonzero(np.diff(codes)) + 1
+        frame_starts = np.flatnonzero((np.diff(codes) != 0) | (np.diff(brs) != 0)) + 1
+
+        def ranges(starts):
+            starts = np.concatenate([[0], starts]) if len(codes) else starts
+            return zip(starts.tolist(), np.append(starts[1:], len(codes)).tolist())
+
+        categories = streams.cat.categories
+        self._stream_ranges = {categories[codes[start]]: (start, stop) for start, stop in ranges(stream_starts)}
+        self._frame_ranges = {
+            (categories[codes[start]], brs[start].item()): (start, stop) for start, stop in ranges(frame_starts)
+        }
+
+    def stream_df(self, stream: Stream) -> pd.DataFrame:
+        return self.df.iloc[self._stream_rows.get(stream.name, [])]
+
+    def stream_details(self, stream: Stream) -> pd.DataFrame:
+        if self.frame_store is not None:
+            return self.frame_store.read(stream.name)
+        start, stop = self._stream_ranges.get(stream.name, (0, 0))
+        return self.details_df.iloc[start:stop]
+
+    def stream_frame_count(self, stream: Stream) -> int:
+        # len(stream_details(stream)) without reading the frames
+        if self.frame_store is not None:
+            return sum(stop - start for _, name, _, start, stop in self.frame_store.segments if name == stream.name)
+        start, stop = self._stream_ranges.get(stream.name, (0, 0))
+        return stop - start
+
+    def frame_details(self, stream: Stream, br) -> pd.DataFrame:
+        if self.frame_store is not None:
+            return self.frame_store.read(stream.name, br)
+        start, stop = self._frame_ranges.get((stream.name, br), (0, 0))
+        return self.details_df.iloc[start:stop]
+
+    def frame_aggregates(self) -> pd.DataFrame:
+        # (stream, tool, br_or_qp) x (aggregate, column) for all streams, computed once
+        if self._frame_aggregates is None:
+            with profiler.stage('worst aggregates') as record:
+                if self.frame_store is not None and self.streams:
+                    # one stream's frames in memory at a time
+                    self._frame_aggregates = pd.concat([
+                        aggregate_frames(self.stream_details(stream), self.worst_aggregates) for stream in self.streams
+                    ])
+                else:
+                    self._frame_aggregates = aggregate_frames(self.details_df, self.worst_aggregates)
+                record.rows += self.frame_count()
+        return self._frame_aggregates
+
+    def slice(self, stream: Stream) -> 'DataBank':
+        bank = copy.copy(self)
+        bank.streams = [stream]
+        bank.artifacts = [artifact for artifact in self.artifacts if artifact.stream.name == stream.name]
+        bank.df = self.stream_df(stream)
+        if self.frame_store is None:
+            bank.details_df = self.stream_details(stream)
+        bank._build_index()
+        if self._frame_aggregates is not None:
+            aggregates = self._frame_aggregates
+            bank._frame_aggregates = aggregates[aggregates.index.get_level_values('stream') == stream.name]
+        return bank
+
+
+def update_record(record: Dict[str, Union[str,float]], metric: str, section: Dict[str,Any]) -> None:
+    if metric in section:
+        y = section[metric]['Y']
+        u = section[metric]['U']
+        v = section[metric]['V']
+        yuv = (4*y + u + v) / 6
+        record.update({
+            f'{metric}_Y': y,
+            f'{metric}_U': u,
+            f'{metric}_V': v,
+            f'{metric}_YUV': yuv
+        })
+
+
+def parse_summary(fn: Path, metrics) -> Dict[str, float]:
+    with fn.open(encoding='utf8') as f:
+        yml = yaml.safe_load(f)
+
+    record = {'real_bitrate': yml['real_bitrate']}
+    section = yml.get('metrics', {})
+    if 'VMAF' in metrics and 'VMAF' in section:
+        record['VMAF'] = section['VMAF']
+
+    for metric in METRICS:
+        if metric in metrics:
+            update_record(record, metric, section)
+
+    return record
+
+
+def yaml_number(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return {'.nan': np.nan, '.inf': np.inf, '+.inf': np.inf, '-.inf': -np.inf}.get(value.lower(), np.nan)
+
+
+def parse_details(fn: Path, metrics) -> Dict[str, np.ndarray]:
+    # walks the parser events instead of building the document, so memory holds one frame plus the column buffers
+    names = ['frame_size'] + (['VMAF'] if 'VMAF' in metrics else [])
+    names += [f'{metric}_{component}' for metric in METRICS if metric in metrics for component in 'YUV']
+    buffers = {name: array('d') for name in names}
+    seen = set()
+
+    level = 0       # 1: inside the frame list, 2: inside a frame, 3: inside a metric section of a frame
+    skip = 0        # nesting depth of a value that is not understood and skipped
+    frame = {}
+    key = section = sub_key = None
+    with fn.open(encoding='utf8') as f:
+        for event in yaml.parse(f, Loader=SafeLoader):
+            if skip:
+                if isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+                    skip += 1
+                elif isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+                    skip -= 1
+                    if not skip and level == 2:
+                        key = None
+                    elif not skip and level == 3:
+                        sub_key = None
+                continue
+
+            if isinstance(event, (yaml.ScalarEvent, yaml.AliasEvent)):
+                value = event.value if isinstance(event, yaml.ScalarEvent) else ''
+                if level == 2 and key is None:
+                    key = value
+                elif level == 2:
+                    frame[key] = yaml_number(value)
+                    key = None
+                elif level == 3 and sub_key is None:
+                    sub_key = value
+                elif level == 3:
+                    frame[f'{section}_{sub_key}'] = yaml_number(value)
+                    sub_key = None
+            elif isinstance(event, yaml.MappingStartEvent):
+                if level == 1:
+                    level = 2
+                    frame = {}
+                    key = None
+                elif level == 2 and key is not None:
+                    level = 3
+                    section, key, sub_key = key, None, None
+                else:
+                    skip = 1
+            elif isinstance(event, yaml.MappingEndEvent):
+                if level == 3:
+                    level = 2
+                elif level == 2:
+                    level = 1
+                    seen.update(frame)
+                    for name, values in buffers.items():
+                        values.append(frame.get(name, np.nan))
+            elif isinstance(event, yaml.SequenceStartEvent):
+                if level == 0:
+                    level = 1
+                else:
+                    skip = 1
+            elif isinstance(event, yaml.SequenceEndEvent) and level == 1:
+                level = 0
+
+    columns = {}
+    if 'VMAF' in buffers and 'VMAF' in seen:
+        columns['VMAF'] = np.frombuffer(buffers['VMAF'])
+    if 'frame_size' in seen:
+        columns['frame_size'] = np.frombuffer(buffers['frame_size'])
+    for metric in METRICS:
+        if metric in metrics and any(f'{metric}_{component}' in seen for component in 'YUV'):
+            y, u, v = (np.frombuffer(buffers[f'{metric}_{component}']) for component in 'YUV')
+            columns.update({
                 f'{metric}_Y': y,
                 f'{metric}_U': u,
                 f'{metric}_V': v,
-                f'{metric}_YUV': yuv
+                f'{metric}_YUV': (4*y + u + v) / 6
             })
 
-    def load_yaml(self, tool: Tool, stream: Stream, br: int, fn: Path):
-        with fn.open(encoding='utf8') as f:
-            yml = yaml.safe_load(f)
-
-        record = {
-            'tool': tool.name,
-            'stream': stream.name,
-            'br_or_qp': br,
-            'real_bitrate': yml['real_bitrate']
-        }
-        metrics = yml.get('metrics', {})
-        if 'VMAF' in metrics:
-            record['VMAF'] = metrics['VMAF']
-
-        self._update_record(record, 'PSNR', metrics)
-        self._update_record(record, 'SSIM', metrics)
-        self._update_record(record, 'MSSIM', metrics)
-
-        self.df = self.df.append(record, ignore_index=True)
+    return columns
 
-    def load_details(self, tool: Tool, stream: Stream, br: int, fn: Path):
-        with fn.open(encoding='utf8') as f:
-            yml = yaml.safe_load(f)
 
-        records = []
-        for i, frame in enumerate(yml):
-            record = {
-                'tool': tool.name,
-                'stream': stream.name,
-                'br_or_qp': br,
-                'frame': i
-            }
-            if 'VMAF' in frame:
-                record['VMAF'] = frame['VMAF']
-            if 'frame_size' in frame:
-                record['frame_size'] = frame['frame_size']
-                self.has_file_sizes = True
-
-            self._update_record(record, 'PSNR', frame)
-            self._update_record(record, 'SSIM', frame)
-            self._update_record(record, 'MSSIM', frame)
-
-            records.append(record)
-
-        self.details_df = self.details_df.append(pd.DataFrame(records), ignore_index=True)
+def parse_artifact(kind: str, fn: Path, metrics, stream: str = ''):
+    with profiler.stage(f'parse {kind}', stream) as record:
+        if kind == 'details':
+            data = parse_details(fn, metrics)
+            record.rows += len(next(iter(data.values()), []))
+        else:
+            data = parse_summary(fn, metrics)
+            record.rows += 1
+    return data
 
 
 def load_global_settings(bank:DataBank, cfg:Dict[str,Any]):
@@ -166,12 +698,33 @@ def load_global_settings(bank:DataBank, cfg:Dict[str,Any]):
         bank.extra_metrics.update(metric.upper() for metric in cfg['extra-metrics'])
     if 'per-frame-metrics' in cfg:
         bank.per_frame_metrics.update(metric.upper() for metric in cfg['per-frame-metrics'])
+    if 'worst-aggregates' in cfg:
+        for aggregate in cfg['worst-aggregates']:
+            aggregate = str(aggregate).lower()
+            if not is_aggregate(aggregate):
+                sys.exit(f'Unknown worst aggregate "{aggregate}", use min, std, hmean or p<N> for the N-th percentile'
+                         ' (N a whole number from 0 to 100)')
+            if aggregate.startswith('p'):
+                # p05 and p5 are the same percentile, one name keeps them one chart
+                aggregate = f'p{int(aggregate[1:])}'
+            if aggregate not in bank.worst_aggregates:
+                bank.worst_aggregates.append(aggregate)
+    if cfg.get('downsample'):
+        section = cfg['downsample'] if isinstance(cfg['downsample'], dict) else {}
+        method = str(section.get('method', Downsample.method)).lower()
+        if method not in DOWNSAMPLE_METHODS:
+            sys.exit(f'Unknown downsample method "{method}", use envelope or lttb')
+        points = section.get('points', Downsample.points)
+        if not isinstance(points, int) or points < 4:
+            sys.exit(f'Downsample points must be an integer of at least 4, got "{points}"')
+        bank.downsample = Downsample(method, points)
 
 
 def load_tools(bank: DataBank, tool_section: List[Dict[str,str]], artifacts_path):
     for i, tool in enumerate(tool_section, 1):
         label = tool.get('label')
         if not label:
+            from num2words import num2words
             sys.exit(f'There is no label in the {num2words(i, ordinal=True)} tool section')
         if 'command-line' in tool:
             bank.add_tool(Tool(tool, artifacts_path, qp=False))
@@ -184,34 +737,193 @@ def load_streams(bank: DataBank, stream_section: List[Dict[str,str]]):
         bank.add_stream(Stream(stream))
 
 
-def load_data(cfg, artifacts_path):
-    bank = DataBank()
-    load_global_settings(bank, cfg)
-    load_tools(bank, cfg.get('tools', []), artifacts_path)
-    load_streams(bank, cfg.get('streams', []))
+def in_partition(name: str, index: int, count: int) -> bool:
+    # stable across machines and Python runs, unlike hash()
+    return int(hashlib.md5(name.encode('utf-8')).hexdigest(), 16) % count == index - 1
+
+
+def select_shard(bank: DataBank, shard: Shard):
+    if shard.streams:
+        bank.streams = [stream for stream in bank.streams if any(fnmatch(stream.name, p) for p in shard.streams)]
+    if shard.tools:
+        bank.tools = [tool for tool in bank.tools if any(fnmatch(tool.label, p) for p in shard.tools)]
+    if not bank.streams or not bank.tools:
+        sys.exit(f'The shard patterns select {len(bank.tools)} tools and {len(bank.streams)} streams, nothing to load')
+    # with more partitions than streams some are empty, they still make a (empty) shard
+    bank.streams = [stream for stream in bank.streams if in_partition(stream.name, shard.index, shard.count)]
+
+
+# <rate point>.<stream>.yaml and <rate point>.<stream>.details.yaml, the rate point of a cqp run is qp-<qp>
+ARTIFACT_NAME = re.compile(r'^(qp-)?([^.]+)\.(.+?)(\.details)?\.yaml$')
+
+
+def scan_folder(folder: Path) -> Dict[Tuple[bool, str, str, str], os.DirEntry]:
+    # one directory listing per tool folder instead of a stat() probe per expected file
+    index = {}
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                match = ARTIFACT_NAME.match(entry.name)
+                if match:
+                    qp, br, stream, details = match.groups()
+                    index[(bool(qp), br, stream, 'details' if details else 'summary')] = entry
+    except FileNotFoundError:
+        pass
+    return index
+
+
+def report_missing(missing: List[Tuple[str, str, str, Any]]) -> None:
+    # one table row per (tool, stream, kind) with the rate points that have no file
+    rows = {}
+    for tool, stream, kind, br in missing:
+        rows.setdefault((tool, stream, kind), []).append(str(br))
+
+    header = ('tool', 'stream', 'kind', 'missing rate points')
+    table = [header] + [(tool, stream, kind, ', '.join(brs)) for (tool, stream, kind), brs in rows.items()]
+    widths = [max(len(row[i]) for row in table) for i in range(3)]
 
+    print(f'{len(missing)} artifacts not found:', file=sys.stderr)
+    for row in table:
+        print('  ' + '  '.join(cell.ljust(width) for cell, width in zip(row, widths)) + '  ' + row[3], file=sys.stderr)
+
+
+def collect_artifacts(bank: DataBank, verbose=True) -> List[Artifact]:
+    artifacts = []
+    missing = []
     for tool in bank.tools:
-        print(f'{tool.name}')
+        if verbose:
+            print(f'{tool.name}')
+        index = scan_folder(tool.folder)
         bitrates = bank.common_qp if tool.qp else bank.common_bitrates
         for stream in bank.streams:
-            print(f'  {stream.name}')
+            if verbose:
+                print(f'  {stream.name}')
             stream_bitrates = stream.qp if tool.qp else stream.bitrates
             for br in stream_bitrates or bitrates:
-                if tool.qp:
-                    main_yaml = tool.folder / f'qp-{br}.{stream.name}.yaml'
-                    details = tool.folder / f'qp-{br}.{stream.name}.details.yaml'
-                else:
-                    main_yaml = tool.folder / f'{br}.{stream.name}.yaml'
-                    details = tool.folder / f'{br}.{stream.name}.details.yaml'
+                kinds = ['summary']
+                if bank.per_frame_metrics:
+                    kinds.append('details')
+
+                for kind in kinds:
+                    entry = index.get((tool.qp, str(br), stream.name, kind))
+                    if entry is None:
+                        missing.append((tool.name, stream.name, kind, br))
+                        continue
+                    st = entry.stat()
+                    artifacts.append(Artifact(kind, tool, stream, br, Path(entry.path), st.st_size, st.st_mtime_ns))
+
+    if missing and verbose:
+        report_missing(missing)
+
+    return artifacts
+
+
+def iter_artifacts(bank: DataBank, artifacts: List[Artifact], jobs=1,
+                   use_cache=True) -> Iterator[Tuple[Artifact, Dict[str, Any]]]:
+    # (artifact, parsed values) in artifact order as they come from the parsed cache or the parser, so
+    # only the artifacts in flight are held in memory; the caches are written once the last one is yielded
+    metrics = frozenset(bank.metrics())
+
+    with contextlib.ExitStack() as stack:
+        with profiler.stage('read parsed cache') as record:
+            caches = {}
+            if use_cache:
+                caches = {tool.name: ArtifactCache(tool, metrics) for tool in bank.tools if tool.folder.exists()}
+            for cache in caches.values():
+                stack.callback(cache.close)
+            hits = [artifact.tool.name in caches and caches[artifact.tool.name].has(artifact)
+                    for artifact in artifacts]
+        misses = [artifact for artifact, hit in zip(artifacts, hits) if not hit]
+
+        kinds = [artifact.kind for artifact in misses]
+        paths = [artifact.path for artifact in misses]
+        streams = [artifact.stream.name for artifact in misses]
+        if jobs > 1 and len(misses) > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+            # map() yields in submission order, so rows land exactly as in the serial walk
+            results = executor.map(
+                profiled, repeat(profiler.enabled), repeat(parse_artifact), kinds, paths, repeat(metrics), streams,
+                chunksize=max(1, len(misses) // (jobs * 4))
+            )
+        else:
+            results = ((parse_artifact(kind, fn, metrics, stream), []) for kind, fn, stream in zip(kinds, paths, streams))
+
+        for artifact, hit in zip(artifacts, hits):
+            cache = caches.get(artifact.tool.name)
+            if hit:
+                with profiler.stage('read parsed cache') as record:
+                    data = cache.get(artifact)
+                    record.rows += 1
+            else:
+                data, stages = next(results)
+                profiler.merge(stages)
+                if cache is not None:
+                    cache.put(artifact, data)
+            yield artifact, data
+
+        with profiler.stage('write parsed cache'):
+            for cache in caches.values():
+                cache.save()
+
+    if caches:
+        print(f'{len(artifacts) - len(misses)} of {len(artifacts)} artifacts read from the parsed cache')
+
+
+def parse_artifacts(bank: DataBank, artifacts: List[Artifact], jobs=1, use_cache=True) -> List[Dict[str, Any]]:
+    return [data for _, data in iter_artifacts(bank, artifacts, jobs, use_cache)]
+
+
+def configured_bank(cfg, tools: List[str], streams: List[str]) -> DataBank:
+    # the settings of cfg with only the named tools and streams, in configuration order; for rows
+    # loaded elsewhere (shards, exports), so there is no artifacts path
+    bank = DataBank()
+    bank.config = cfg
+    load_global_settings(bank, cfg)
+    load_tools(bank, cfg.get('tools', []), None)
+    load_streams(bank, cfg.get('streams', []))
+    bank.tools = [tool for tool in bank.tools if tool.name in tools]
+    bank.streams = [stream for stream in bank.streams if stream.name in streams]
+    return bank
 
-                if not main_yaml.exists():
-                    print(f'"{main_yaml}" does not exists', file=sys.stderr)
-                else:
-                    bank.load_yaml(tool, stream, br, main_yaml)
 
-                if bank.per_frame_metrics and not details.exists():
-                    print(f'"{details}" does not exists', file=sys.stderr)
-                elif bank.per_frame_metrics:
-                    bank.load_details(tool, stream, br, details)
+def artifact_rows(artifacts: List[Artifact]) -> List[List[Any]]:
+    return [
+        [artifact.kind, artifact.tool.name, artifact.stream.name, artifact.br, artifact.path.name, artifact.size,
+         artifact.mtime]
+        for artifact in artifacts
+    ]
 
+
+def restore_artifacts(bank: DataBank, rows: List[List[Any]]) -> List[Artifact]:
+    # what artifact_rows() recorded, enough for page digests; the path is only the file name
+    tools = {tool.name: tool for tool in bank.tools}
+    streams = {stream.name: stream for stream in bank.streams}
+    return [
+        Artifact(kind, tools[tool], streams[stream], br, Path(name), size, mtime)
+        for kind, tool, stream, br, name, size, mtime in rows
+    ]
+
+
+def load_data(cfg, artifacts_path, jobs=1, use_cache=True, frame_store=None, shard: Optional[Shard] = None):
+    bank = DataBank()
+    bank.config = cfg
+    load_global_settings(bank, cfg)
+    load_tools(bank, cfg.get('tools', []), artifacts_path)
+    load_streams(bank, cfg.get('streams', []))
+    if shard:
+        select_shard(bank, shard)
+    if frame_store:
+        bank.use_frame_store(frame_store)
+
+    with profiler.stage('scan artifacts') as record:
+        artifacts = bank.artifacts = collect_artifacts(bank)
+        record.rows += len(artifacts)
+
+    # each artifact goes to the bank as soon as it is parsed, with a frame store its rows are on disk then
+    for artifact, data in iter_artifacts(bank, artifacts, jobs, use_cache):
+        bank.add_artifact(artifact, data)
+
+    with profiler.stage('build frames') as record:
+        bank.finalize()
+        record.rows += len(bank.df) + bank.frame_count()
     return bank
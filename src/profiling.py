@@ -0,0 +1,101 @@
+import sys
+import json
+import time
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Any
+
+
+class Record:
+    __slots__ = ('calls', 'seconds', 'rows', 'bytes')
+
+    def __init__(self, calls=0, seconds=0.0, rows=0, bytes=0):
+        self.calls = calls
+        self.seconds = seconds
+        self.rows = rows
+        self.bytes = bytes
+
+
+class Profiler:
+    """Wall time, call count, rows processed and bytes read or written per (stage, stream).
+
+    Disabled by default, so the instrumented code only pays for a context manager. Stages timed
+    in worker processes are sent back with the result and merged, their seconds add up over workers.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.started = time.time()
+        self.stages: Dict[Tuple[str, str], Record] = {}
+
+    @contextmanager
+    def stage(self, name: str, stream: str = ''):
+        if not self.enabled:
+            yield Record()
+            return
+
+        record = self.stages.setdefault((name, stream), Record())
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.calls += 1
+            record.seconds += time.perf_counter() - start
+
+    def collect(self) -> List[List[Any]]:
+        rows = [[name, stream, r.calls, r.seconds, r.rows, r.bytes] for (name, stream), r in self.stages.items()]
+        self.stages = {}
+        return rows
+
+    def merge(self, rows: List[List[Any]]):
+        for name, stream, calls, seconds, count, size in rows:
+            record = self.stages.setdefault((name, stream), Record())
+            record.calls += calls
+            record.seconds += seconds
+            record.rows += count
+            record.bytes += size
+
+    def totals(self) -> Dict[str, Record]:
+        totals = {}
+        for (name, _), r in self.stages.items():
+            total = totals.setdefault(name, Record())
+            total.calls += r.calls
+            total.seconds += r.seconds
+            total.rows += r.rows
+            total.bytes += r.bytes
+        return totals
+
+    def report(self) -> Dict[str, Any]:
+        def fields(r: Record):
+            return {'calls': r.calls, 'seconds': round(r.seconds, 6), 'rows': r.rows, 'bytes': r.bytes}
+
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'seconds': round(time.time() - self.started, 3),
+            'argv': sys.argv[1:],
+            'totals': {name: fields(r) for name, r in self.totals().items()},
+            'stages': [dict(stage=name, stream=stream, **fields(r)) for (name, stream), r in self.stages.items()],
+        }
+
+    def save(self, fn: Path):
+        fn.write_text(json.dumps(self.report(), indent=2))
+
+    def print_summary(self, file=sys.stdout):
+        table = [('stage', 'calls', 'seconds', 'rows', 'bytes')]
+        for name, r in self.totals().items():
+            table.append((name, str(r.calls), f'{r.seconds:.3f}', f'{r.rows:,}', f'{r.bytes:,}'))
+        widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+        for row in table:
+            cells = [row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+            print('  '.join(cells), file=file)
+        print(f'total {time.time() - self.started:.3f}s', file=file)
+
+
+profiler = Profiler()
+
+
+def profiled(enabled: bool, function, *args):
+    # runs function in a worker process and returns its result with the stages it recorded
+    profiler.enabled = enabled
+    profiler.stages = {}
+    result = function(*args)
+    return result, profiler.collect()
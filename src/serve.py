@@ -0,0 +1,107 @@
+import json
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote, unquote, urlsplit
+from typing import Dict, Optional
+
+from loader import DataBank
+from charts import PageOptions, chart_index, index_html, page_html, page_name
+
+
+class ChartServer(ThreadingHTTPServer):
+    """Serves the summary index and the page shells of a loaded DataBank, and builds each chart spec when the
+    page asks for it.
+
+    Pages are the lazy pages of generate.py --lazy, their payloadUrl points back to this server. Built
+    specs are kept in an LRU cache of cache_size entries.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, bank: DataBank, cache_size=256, options: Optional[PageOptions] = None):
+        super().__init__(address, ChartHandler)
+        self.bank = bank
+        self.options = options or PageOptions()
+        self.streams = {stream.name: stream for stream in bank.streams}
+        self.pages = {page_name(stream): stream for stream in bank.streams}
+        self.indexes = {}
+        self.index_page = None
+        self.cache_size = cache_size
+        self.specs = OrderedDict()
+        # building a spec touches shared frames and the Altair skeleton cache, one at a time
+        self.lock = threading.Lock()
+
+    def index(self, stream) -> Dict[str, Dict]:
+        if stream.name not in self.indexes:
+            self.indexes[stream.name] = chart_index(self.bank, stream)
+        return self.indexes[stream.name]
+
+    def page(self, stream) -> str:
+        with self.lock:
+            index = self.index(stream)
+            chart_keys = {kind: list(charts) for kind, charts in index.items()}
+            chart_keys['datasets'] = []
+            payload_url = f'/stream/{quote(stream.name)}/{{kind}}/{{key}}'
+            return page_html(self.bank, stream, {kind: [] for kind in index}, {}, chart_keys, payload_url)
+
+    def spec(self, stream, kind: str, key: str) -> Optional[str]:
+        with self.lock:
+            cache_key = (stream.name, kind, key)
+            if cache_key in self.specs:
+                self.specs.move_to_end(cache_key)
+                return self.specs[cache_key]
+
+            build = self.index(stream).get(kind, {}).get(key)
+            if build is None:
+                return None
+            spec = self.specs[cache_key] = build(self.options)
+            if len(self.specs) > self.cache_size:
+                self.specs.popitem(last=False)
+            return spec
+
+    def summary(self) -> str:
+        with self.lock:
+            if self.index_page is None:
+                self.index_page = index_html(self.bank, self.options)
+            return self.index_page
+
+
+class ChartHandler(BaseHTTPRequestHandler):
+    server: ChartServer
+
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path)
+        parts = path.strip('/').split('/')
+
+        if path in ('/', '/index.html'):
+            self.reply(200, 'text/html', self.server.summary())
+        elif len(parts) == 1 and parts[0] in self.server.pages:
+            self.reply(200, 'text/html', self.server.page(self.server.pages[parts[0]]))
+        elif len(parts) == 4 and parts[0] == 'stream' and parts[1] in self.server.streams:
+            spec = self.server.spec(self.server.streams[parts[1]], parts[2], parts[3])
+            if spec is None:
+                self.reply(404, 'application/json', json.dumps({'error': f'no {parts[2]} chart "{parts[3]}"'}))
+            else:
+                self.reply(200, 'application/json', spec)
+        else:
+            self.reply(404, 'text/plain', f'{path} not found')
+
+    def reply(self, status: int, content_type: str, body: str):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(bank: DataBank, host='127.0.0.1', port=8000, cache_size=256, options: Optional[PageOptions] = None):
+    server = ChartServer((host, port), bank, cache_size, options)
+    print(f'Serving {len(bank.streams)} streams on http://{host}:{server.server_port}/, press Ctrl+C to stop')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
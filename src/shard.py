@@ -0,0 +1,167 @@
+import sys
+import json
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from loader import DataBank, configured_bank, artifact_rows, restore_artifacts, metric_columns, METRIC_COLUMNS
+from profiling import profiler
+
+
+# bump when the layout of the arrays below changes
+SHARD_VERSION = 1
+
+
+def shard_details(bank: DataBank) -> pd.DataFrame:
+    if bank.frame_store is not None:
+        frames = [bank.stream_details(stream) for stream in bank.streams]
+        return pd.concat(frames, ignore_index=True) if frames else bank.details_df
+    return bank.details_df
+
+
+def save_shard(bank: DataBank, fn: Path):
+    """Writes what a build node loaded: the configuration, the tools and streams it covered, the summary rows,
+    the per-frame rows and the worst-frame aggregates, so merge_shards() rebuilds the DataBank without YAML.
+    """
+    values = metric_columns(bank.metrics())
+    details = shard_details(bank)
+    # one contiguous segment per details file, the unit DataBank.add_details() takes
+    details = details.sort_values(['tool', 'stream', 'br_or_qp'], kind='stable', ignore_index=True)
+    segments = details.groupby(['tool', 'stream', 'br_or_qp'], observed=True, sort=False).size().reset_index()
+    aggregates = bank.frame_aggregates() if bank.has_details() else pd.DataFrame()
+
+    arrays = {
+        'version': np.array(SHARD_VERSION),
+        'settings': np.array(json.dumps({
+            'config': bank.config,
+            'tools': [tool.name for tool in bank.tools],
+            'streams': [stream.name for stream in bank.streams],
+            'has_file_sizes': bank.has_file_sizes,
+            'artifacts': artifact_rows(bank.artifacts),
+            'aggregates': [list(column) for column in aggregates.columns],
+            'aggregate_dtypes': [str(dtype) for dtype in aggregates.dtypes],
+        })),
+        'summary_tool': bank.df['tool'].astype(str).to_numpy(dtype=str),
+        'summary_stream': bank.df['stream'].astype(str).to_numpy(dtype=str),
+        'summary_br': bank.df['br_or_qp'].to_numpy(),
+        'segment_tool': segments['tool'].astype(str).to_numpy(dtype=str),
+        'segment_stream': segments['stream'].astype(str).to_numpy(dtype=str),
+        'segment_br': segments['br_or_qp'].to_numpy(),
+        'segment_offsets': np.concatenate([[0], np.cumsum(segments[0].to_numpy())]).astype(np.int64),
+        'aggregate_stream': aggregates.index.get_level_values('stream').astype(str).to_numpy(dtype=str)
+        if len(aggregates) else np.empty(0, dtype=str),
+        'aggregate_tool': aggregates.index.get_level_values('tool').astype(str).to_numpy(dtype=str)
+        if len(aggregates) else np.empty(0, dtype=str),
+        'aggregate_br': aggregates.index.get_level_values('br_or_qp').to_numpy() if len(aggregates) else np.empty(0),
+        'aggregate_values': aggregates.to_numpy(dtype=np.float64),
+    }
+    for column in values + ['real_bitrate']:
+        arrays[f'summary_{column}'] = bank.df[column].to_numpy()
+    for column in values + ['frame_size']:
+        arrays[f'details_{column}'] = details[column].to_numpy()
+
+    with fn.open('wb') as f:
+        np.savez_compressed(f, **arrays)
+
+
+def read_shard(fn: Path) -> Dict[str, Any]:
+    try:
+        with np.load(fn, allow_pickle=False) as npz:
+            if 'version' not in npz.files or int(npz['version']) != SHARD_VERSION:
+                sys.exit(f'"{fn}" is not a shard written by this version of generate.py')
+            shard = {name: npz[name] for name in npz.files}
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        sys.exit(f'Unable to read shard "{fn}": {e}')
+    shard['settings'] = json.loads(str(shard['settings']))
+    return shard
+
+
+def merge_shards(files: List[Path], frame_store: Optional[Path] = None) -> DataBank:
+    """One DataBank from the shards of a campaign, rows in the order a single node would have loaded them."""
+    with profiler.stage('read shards') as record:
+        shards = [read_shard(fn) for fn in files]
+        record.rows += len(shards)
+
+    cfg = shards[0]['settings']['config']
+    for fn, shard in zip(files, shards):
+        if shard['settings']['config'] != cfg:
+            sys.exit(f'Shard "{fn}" was built from a different configuration than "{files[0]}"')
+
+    bank = configured_bank(
+        cfg,
+        [name for shard in shards for name in shard['settings']['tools']],
+        [name for shard in shards for name in shard['settings']['streams']]
+    )
+    if frame_store:
+        bank.use_frame_store(frame_store)
+
+    tools = {tool.name: tool for tool in bank.tools}
+    streams = {stream.name: stream for stream in bank.streams}
+    tool_order = {tool.name: i for i, tool in enumerate(bank.tools)}
+    stream_order = {stream.name: i for i, stream in enumerate(bank.streams)}
+
+    def order(tool: str, stream: str, br):
+        # tool, stream, then the rate point's place in the configuration, like collect_artifacts()
+        points = streams[stream].br_or_qp(tools[tool]) or bank.br_or_qp(tools[tool])
+        return tool_order[tool], stream_order[stream], points.index(br) if br in points else len(points)
+
+    seen = {}
+    summaries, segments, artifacts = [], [], []
+    for fn, shard in zip(files, shards):
+        for key in {(tool, stream) for tool, stream in zip(shard['summary_tool'], shard['summary_stream'])}:
+            if key in seen:
+                sys.exit(f'Shards "{seen[key]}" and "{fn}" both hold {key[0]} results of {key[1]}')
+            seen[key] = fn
+
+        columns = [column for column in METRIC_COLUMNS + ['real_bitrate'] if f'summary_{column}' in shard]
+        for i, (tool, stream, br) in enumerate(zip(shard['summary_tool'], shard['summary_stream'],
+                                                   shard['summary_br'].tolist())):
+            record = {column: shard[f'summary_{column}'][i].item() for column in columns}
+            summaries.append((order(str(tool), str(stream), br), str(tool), str(stream), br, record))
+
+        columns = [column for column in METRIC_COLUMNS + ['frame_size'] if f'details_{column}' in shard]
+        if not shard['settings']['has_file_sizes']:
+            columns.remove('frame_size')
+        offsets = shard['segment_offsets']
+        for i, (tool, stream, br) in enumerate(zip(shard['segment_tool'], shard['segment_stream'],
+                                                   shard['segment_br'].tolist())):
+            frames = {column: shard[f'details_{column}'][offsets[i]:offsets[i + 1]] for column in columns}
+            segments.append((order(str(tool), str(stream), br), str(tool), str(stream), br, frames))
+
+        for row in shard['settings']['artifacts']:
+            kind, tool, stream, br = row[:4]
+            artifacts.append(((order(tool, stream, br), kind == 'details'), row))
+
+    with profiler.stage('build frames') as record:
+        for _, tool, stream, br, values in sorted(summaries, key=lambda row: row[0]):
+            bank.add_summary(tools[tool], streams[stream], br, values)
+        for _, tool, stream, br, frames in sorted(segments, key=lambda row: row[0]):
+            bank.add_details(tools[tool], streams[stream], br, frames)
+        bank.artifacts = restore_artifacts(bank, [row for _, row in sorted(artifacts, key=lambda entry: entry[0])])
+        bank.finalize()
+        record.rows += len(bank.df) + bank.frame_count()
+
+    # the worst-frame aggregates come with the shards, they are not computed again
+    if bank.has_details():
+        parts = []
+        for shard in shards:
+            if not shard['settings']['aggregates']:
+                continue
+            index = pd.MultiIndex.from_arrays(
+                [shard['aggregate_stream'], shard['aggregate_tool'], shard['aggregate_br']],
+                names=['stream', 'tool', 'br_or_qp']
+            )
+            columns = pd.MultiIndex.from_tuples([tuple(column) for column in shard['settings']['aggregates']])
+            part = pd.DataFrame(shard['aggregate_values'], index=index, columns=columns)
+            parts.append(part.astype(dict(zip(columns, shard['settings']['aggregate_dtypes']))))
+        aggregates = pd.concat(parts)
+        aggregates.index = pd.MultiIndex.from_arrays([
+            pd.Categorical(aggregates.index.get_level_values(level)) for level in ('stream', 'tool')
+        ] + [aggregates.index.get_level_values('br_or_qp')], names=aggregates.index.names)
+        bank._frame_aggregates = aggregates
+
+    print(f'{len(shards)} shards merged: {len(bank.tools)} tools, {len(bank.streams)} streams')
+    return bank
@@ -0,0 +1,138 @@
+import re
+import json
+import hashlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# every page chart is a per-tool line chart with a legend selection; the shape is what differs between them
+@dataclass(frozen=True)
+class Shape:
+    x: str
+    y: str
+    tooltips: Tuple[Tuple[str, Optional[str], Optional[str]], ...]
+    x_title: Optional[str] = None
+    y_title: Optional[str] = None
+    x_zero: bool = True
+    width: Optional[int] = None
+    legend_top: bool = False
+
+
+def widen_float32(values: np.ndarray) -> np.ndarray:
+    # float32 metrics would serialize with float64 noise (38.12345504760742), keep 7 significant digits instead
+    values = values.astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = 10.0 ** (7 - np.ceil(np.log10(np.abs(values))))
+        return np.where(np.isfinite(scale) & np.isfinite(values), np.round(values * scale) / scale, values)
+
+
+def to_values(data):
+    if isinstance(data, pd.DataFrame):
+        columns = data.select_dtypes('float32').columns
+        if len(columns):
+            data = data.assign(**{column: widen_float32(data[column].to_numpy()) for column in columns})
+    return altair().to_values(data)
+
+
+def altair():
+    # imported on first use only, altair and its schema validation are most of the startup time
+    import altair as alt
+    if alt.data_transformers.active != 'edc':
+        alt.data_transformers.register('edc', to_values)
+        alt.data_transformers.enable('edc')
+    return alt
+
+
+def altair_chart(data, shape: Shape):
+    alt = altair()
+
+    def undefined(value):
+        return alt.Undefined if value is None else value
+
+    selection = alt.selection_multi(fields=['tool'], bind='legend')
+    chart = alt.Chart(data).mark_line(point=True, interpolate='monotone').encode(
+        alt.X(
+            f'{shape.x}:Q',
+            scale=alt.Undefined if shape.x_zero else alt.Scale(zero=False),
+            title=undefined(shape.x_title)
+        ),
+        alt.Y(f'{shape.y}:Q', scale=alt.Scale(zero=False), title=undefined(shape.y_title)),
+        color='tool:N',
+        tooltip=[
+            alt.Tooltip(f'{field}:Q', format=undefined(fmt), title=undefined(title))
+            for field, fmt, title in shape.tooltips
+        ],
+        opacity=alt.condition(selection, alt.value(1), alt.value(0.1))
+    )
+    if shape.width:
+        chart = chart.properties(width=shape.width)
+    if shape.legend_top:
+        chart = chart.configure_legend(orient='top')
+    return chart.interactive().add_selection(selection)
+
+
+def altair_spec(data, shape: Shape) -> str:
+    # the reference path: full Altair construction, validation and a JSON round trip
+    return json.dumps(json.loads(altair_chart(data, shape).to_json()), separators=(',', ':'))
+
+
+@lru_cache(maxsize=None)
+def skeleton(shape: Shape) -> str:
+    # the chart spec without data, with a placeholder where the data reference goes
+    spec = altair_chart(altair().NamedData(name='@data@'), shape).to_dict()
+    spec['data'] = '@data@'
+    return json.dumps(spec, sort_keys=True, separators=(',', ':'))
+
+
+def rows_json(df: pd.DataFrame) -> str:
+    # same rows Altair would emit (keys sorted, NaN and +-inf as null), serialized once
+    columns = sorted(df.columns)
+    values = []
+    for column in columns:
+        series = df[column]
+        if series.dtype.kind != 'f':
+            values.append(series.tolist())
+            continue
+        if series.dtype == 'float32':
+            floats = widen_float32(series.to_numpy())
+        else:
+            floats = series.to_numpy(dtype=np.float64)
+        column_values = floats.tolist()
+        missing = ~np.isfinite(floats)
+        if missing.any():
+            column_values = [None if gone else value for value, gone in zip(column_values, missing.tolist())]
+        values.append(column_values)
+
+    return json.dumps([dict(zip(columns, row)) for row in zip(*values)], separators=(',', ':'))
+
+
+def named_spec(shape: Shape, name: str, rows: Optional[str] = None) -> str:
+    data = json.dumps({'name': name}, separators=(',', ':'))
+    if rows is not None:
+        # "datasets" sorts right after "data", so the spec keeps Altair's sorted key order
+        data += f',"datasets":{{{json.dumps(name)}:{rows}}}'
+    return skeleton(shape).replace('"@data@"', data, 1)
+
+
+def inline_spec(df: pd.DataFrame, shape: Shape) -> str:
+    rows = rows_json(df)
+    return named_spec(shape, f'data-{hashlib.md5(rows.encode("utf-8")).hexdigest()}', rows)
+
+
+def normalized(spec: str) -> dict:
+    # drop the names Altair generates per chart (selectorNNN, data-<md5>) so specs can be compared
+    names = {}
+    text = re.sub(r'selector\d+', lambda m: names.setdefault(m.group(0), f'selector{len(names)}'), spec)
+    jsn = json.loads(text)
+    datasets = jsn.pop('datasets', {})
+    if isinstance(jsn.get('data'), dict) and jsn['data'].get('name') in datasets:
+        jsn['data'] = {'values': datasets[jsn['data']['name']]}
+    return jsn
+
+
+def same_spec(spec: str, reference: str) -> bool:
+    return normalized(spec) == normalized(reference)
@@ -0,0 +1,61 @@
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import yaml
+
+from loader import DataBank, Artifact, collect_artifacts, parse_artifacts
+from charts import generate_charts, PageOptions
+
+
+def signature(artifacts: List[Artifact]) -> Dict[Tuple[str, str, str, str], Tuple[int, int]]:
+    return {
+        (artifact.kind, artifact.tool.name, artifact.stream.name, str(artifact.br)): (artifact.size, artifact.mtime)
+        for artifact in artifacts
+    }
+
+
+def settled(bank: DataBank, debounce: float) -> List[Artifact]:
+    # a campaign finishes files in bursts, rescan until nothing changed for debounce seconds
+    artifacts = collect_artifacts(bank, verbose=False)
+    while True:
+        time.sleep(debounce)
+        latest = collect_artifacts(bank, verbose=False)
+        if signature(latest) == signature(artifacts):
+            return latest
+        artifacts = latest
+
+
+def watch(bank: DataBank, charts_folder, interval=2.0, debounce=5.0, jobs=1, use_cache=True,
+          options: PageOptions = None):
+    print(f'Watching {len(bank.tools)} tool folders for new results, press Ctrl+C to stop')
+    rejected = None
+    try:
+        while True:
+            time.sleep(interval)
+            known = signature(bank.artifacts)
+            if signature(collect_artifacts(bank, verbose=False)) == known:
+                continue
+
+            artifacts = settled(bank, debounce)
+            current = signature(artifacts)
+            if current == rejected:
+                continue
+            changed = {key[2] for key in known.keys() | current.keys() if known.get(key) != current.get(key)}
+            streams = [stream for stream in bank.streams if stream.name in changed]
+            stream_artifacts = [artifact for artifact in artifacts if artifact.stream.name in changed]
+
+            print(f'{time.strftime("%H:%M:%S")} {", ".join(sorted(changed))} changed')
+            try:
+                parsed = parse_artifacts(bank, stream_artifacts, jobs, use_cache)
+            except (OSError, KeyError, TypeError, yaml.YAMLError) as e:
+                # most likely a file still being written, it is picked up again on the next change
+                print(f'Unable to read the new results: {e}', file=sys.stderr)
+                rejected = current
+                continue
+
+            bank.replace_streams(streams, stream_artifacts, parsed)
+            bank.artifacts = artifacts
+            generate_charts(bank, charts_folder, jobs=jobs, options=options)
+    except KeyboardInterrupt:
+        pass